@@ -0,0 +1,210 @@
+"""
+Sweep over the design space of the coils of the ModeladoL* family.
+Every combination of the given values of the turns, heights, radii and wire diameter is built in
+memory with figure_of_wire_path and evaluated in a pool of processes, instead of copying a
+script per variant. The results are written as one table with a column per quantity.
+
+    Run with:
+
+    python Barrido.py resultados.npz --N 3.5 5.5 --N2 40:80:9      # Values or start:stop:count
+    python Barrido.py resultados.parquet --base ModeladoL2_0505 --h 1:3:5
+"""
+
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from Campo import vector_potential
+from Espiras import figure_of_potential
+from Geometria import adaptive_segment_count, figure_of_wire_path
+from Inductancia import inductance
+from Parametros import COILS, didt, element_distance, winding_casing_distance
+
+# The parameters of a design, in the order of the columns of the results
+PARAMETERS = ("N", "h", "N2", "h2", "radio", "radio2", "wire_diam")
+
+# The quantities computed for every design, in the order of the columns of the results
+RESULTS = ("segments", "wire_length", "peak_dadt", "inductance")
+
+
+def parse_values(text: str):
+    """Parses the values of a parameter, a number or start:stop:count for evenly spaced values"""
+    if ":" in text:
+        start, stop, count = text.split(":")
+        return np.linspace(float(start), float(stop), int(count)).tolist()
+
+    return [float(text)]
+
+
+def design_points(base: dict, ranges: dict):
+    """Returns every combination of the values of the parameters
+
+    Parameters
+    ----------
+    base : dict
+        The value of every parameter that is not swept, as the entries of COILS
+    ranges : dict
+        The values of the swept parameters, keyed on their name
+
+    Returns
+    -------
+        The designs, a list of dicts with every parameter
+    """
+    unknown = [name for name in ranges if name not in PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+    values = [ranges.get(name, [base[name]]) for name in PARAMETERS]
+
+    return [dict(zip(PARAMETERS, point)) for point in itertools.product(*values)]
+
+
+def evaluate_design(
+    design: dict,
+    depth: float = 10.0,
+    tolerance: float = 1e-3,
+    samples: int = 41,
+    method: str = "direct",
+    **options,
+):
+    """Builds the windings of a design and computes its figures of merit
+
+    Parameters
+    ----------
+    design : dict
+        The parameters of the design, as the entries of COILS
+    depth : float
+        The distance (mm) below the lowest point of the windings of the plane where the peak
+        of dA/dt is taken
+    tolerance : float
+        The relative field error used to choose the segments per turn, see adaptive_segment_count
+    samples : int
+        The amount of points along each side of the square sampled in the plane, which spans
+        1.5 times the largest radius on each side of the axis
+    method : str
+        The field evaluation method of vector_potential, or 'loops' for the loop stacks of
+        figure_of_potential. The inductance is always summed over the segments
+    options :
+        Passed to vector_potential, e.g. theta for the treecode
+
+    Returns
+    -------
+        The values of RESULTS: the amount of segments, the length of the wire (mm), the peak
+        |dA/dt| in the plane (V/m) at the dI/dt of the stimulator and the inductance (H)
+    """
+    wire_path = figure_of_wire_path(
+        design["radio"],
+        design["N"],
+        design["h"],
+        design["radio2"],
+        design["N2"],
+        design["h2"],
+        adaptive_segment_count(design["N"], tolerance),
+        adaptive_segment_count(design["N2"], tolerance),
+        element_distance,
+        winding_casing_distance,
+    )
+    wire_length = np.linalg.norm(np.diff(wire_path, axis=0), axis=1).sum()
+
+    side = 1.5 * max(design["radio"], design["radio2"])
+    t = np.linspace(-side, side, samples)
+    x, y = np.meshgrid(t, t, indexing="ij")
+    z = np.full_like(x, wire_path[:, 2].min() - depth)
+    plane = np.stack((x, y, z), axis=-1).reshape(-1, 3)
+    if method == "loops":
+        a = figure_of_potential(
+            *(design[name] for name in ("radio", "N", "h", "radio2", "N2", "h2")),
+            element_distance,
+            winding_casing_distance,
+            plane,
+        )
+        method = "direct"
+    else:
+        a = vector_potential(wire_path, plane, method=method, **options)
+    peak_dadt = didt * np.linalg.norm(a, axis=1).max()
+
+    return (
+        len(wire_path) - 1,
+        wire_length,
+        peak_dadt,
+        inductance(wire_path, design["wire_diam"], method=method, **options),
+    )
+
+
+def write_table(fn: str, columns: dict):
+    """Writes a table with one array per column, to a .npz file or to a .parquet file if pyarrow
+    is installed"""
+    if fn.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing parquet files needs pyarrow, use a .npz file instead") from e
+        pq.write_table(pa.table(columns), fn)
+    else:
+        np.savez(fn, **columns)
+
+
+def sweep(
+    fn: str,
+    ranges: dict,
+    base: str = "ModeladoL10505",
+    processes=None,
+    **options,
+):
+    """Evaluates every design of a sweep in parallel and writes the results table
+
+    Parameters
+    ----------
+    fn : str
+        The path of the results table, see write_table
+    ranges : dict
+        The values of the swept parameters, keyed on their name
+    base : str
+        The coil of COILS that gives the parameters that are not swept
+    processes : int
+        The amount of worker processes, the amount of cores if None
+    options :
+        Passed to evaluate_design
+
+    Returns
+    -------
+        The columns of the table, one array per parameter and per result
+    """
+    designs = design_points(COILS[base], ranges)
+
+    with ProcessPoolExecutor(processes) as pool:
+        chunksize = max(1, len(designs) // (4 * (processes or os.cpu_count() or 1)))
+        results = list(pool.map(partial(evaluate_design, **options), designs, chunksize=chunksize))
+
+    columns = {name: np.array([design[name] for design in designs]) for name in PARAMETERS}
+    columns.update({name: np.array(values) for name, values in zip(RESULTS, zip(*results))})
+    write_table(fn, columns)
+
+    return columns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluates a sweep over the parameters of the ModeladoL* coils")
+    parser.add_argument("fn", help="Results table, .npz or .parquet")
+    parser.add_argument("--base", default="ModeladoL10505", choices=list(COILS), help="Coil with the parameters that are not swept")
+    for name in PARAMETERS:
+        parser.add_argument(f"--{name}", nargs="+", default=None, help=f"Values of {name}, numbers or start:stop:count")
+    parser.add_argument("--depth", type=float, default=10.0, help="Depth (mm) below the windings of the peak dA/dt")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Relative field error that sets the segments per turn")
+    parser.add_argument("--processes", type=int, default=None, help="Amount of worker processes")
+    parser.add_argument("--method", default="direct", choices=("direct", "treecode", "loops"), help="Field evaluation method")
+    args = parser.parse_args()
+
+    ranges = {
+        name: [value for text in getattr(args, name) for value in parse_values(text)]
+        for name in PARAMETERS
+        if getattr(args, name) is not None
+    }
+    columns = sweep(
+        args.fn, ranges, args.base, args.processes, depth=args.depth, tolerance=args.tolerance, method=args.method
+    )
+    print(f"{len(columns['N'])} designs written to {args.fn}")
@@ -0,0 +1,147 @@
+"""
+Persistent cache of the dA/dt grids sampled from the wire paths of the coils.
+Each grid is stored as a .npy file named after a hash of everything it depends on, the wire path,
+the dI/dt of the stimulator, the limits and the resolution, so re-running an unchanged coil script
+loads the grid instead of sampling it again. The least recently used grids are removed when the
+cache grows above its size limit.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from Campo import sample_grid
+
+# Bump when the sampling changes so that old grids are not reused
+GRID_VERSION = 1
+
+# Default location and size limit (bytes) of the cache
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "TFM", "campos")
+cache_max_bytes = 8 * 2**30
+
+
+def grid_key(wire_path, didt: float, limits, resolution, **options):
+    """Returns the hash that identifies a sampled grid
+
+    Parameters
+    ----------
+    wire_path : np.ndarray
+        The points of the wire (mm), shape (n, 3)
+    didt : float
+        The rate of change of the current (A/s)
+    limits : list
+        The limits of the grid (mm)
+    resolution : list
+        The spacing of the grid (mm)
+    options :
+        The options of the sampling, see sample_grid
+
+    Returns
+    -------
+        The sha256 of the inputs, as a hex string
+    """
+    wire_path = np.ascontiguousarray(wire_path, dtype=np.float64)
+    h = hashlib.sha256()
+    h.update(str(wire_path.shape).encode())
+    h.update(wire_path.tobytes())
+    h.update(
+        json.dumps(
+            dict(
+                version=GRID_VERSION,
+                didt=float(didt),
+                limits=np.asarray(limits, dtype=float).tolist(),
+                resolution=np.asarray(resolution, dtype=float).tolist(),
+                options=options,
+            ),
+            sort_keys=True,
+        ).encode()
+    )
+
+    return h.hexdigest()
+
+
+class FieldCache:
+    """On-disk cache of sampled grids with least recently used eviction
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the cache, cache_dir if None
+    max_bytes : int
+        The size limit of the cache, cache_max_bytes if None
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = cache_dir if directory is None else directory
+        self.max_bytes = cache_max_bytes if max_bytes is None else max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str):
+        """The file of a grid in the cache"""
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key: str):
+        """Returns the grid of a key, memory-mapped read only, or None if it is not cached"""
+        fn = self.path(key)
+        try:
+            grid = np.load(fn, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        # The modification time is the last use of the grid for the eviction
+        os.utime(fn)
+
+        return grid
+
+    def put(self, key: str, grid):
+        """Stores a grid and evicts the least recently used ones above the size limit"""
+        fn = self.path(key)
+        # Written to a temporary file first so that a crash never leaves a truncated grid
+        tmp = f"{fn}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, grid)
+        os.replace(tmp, fn)
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None):
+        """Removes the least recently used grids until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            fn = os.path.join(self.directory, name)
+            try:
+                st = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and fn == self.path(keep):
+                continue
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def sample(self, wire_path, didt: float, limits, resolution, processes: int = 1, **options):
+        """Returns dA/dt of a wire path on a grid, from the cache if it was already sampled,
+        see sample_grid. A new grid is sampled straight into its file in the cache, so it is held
+        in memory only memory-mapped"""
+        key = grid_key(wire_path, didt, limits, resolution, **options)
+        grid = self.get(key)
+        if grid is None:
+            fn = self.path(key)
+            # Sampled into a temporary file first so that a crash never leaves a truncated grid
+            tmp = f"{fn}.{os.getpid()}.tmp"
+            sample_grid(wire_path, limits, resolution, didt, processes, out=tmp, **options).flush()
+            os.replace(tmp, fn)
+            self.evict(keep=key)
+            grid = self.get(key)
+
+        return grid
@@ -0,0 +1,159 @@
+"""
+Multi-resolution sampling of the field of a coil. The sampling box is split as an octree whose
+leaves hold small regular bricks of dA/dt samples: boxes where trilinear interpolation of their brick
+misses the field by more than a tolerance are split into 8 children, so the samples get dense next
+to the windings and stay sparse in the far field. A dense grid of the same accuracy next to the
+windings would need the finest spacing everywhere.
+"""
+
+import numpy as np
+
+from Campo import vector_potential
+
+
+def _brick_points(lower, upper, t):
+    """Points of the brick of every box at the fractions t of its size, shape (k, n, n, n, 3)"""
+    size = upper - lower
+    grid = np.stack(np.meshgrid(t, t, t, indexing="ij"), axis=-1)
+
+    return lower[:, None, None, None, :] + grid[None] * size[:, None, None, None, :]
+
+
+def _trilinear(bricks, leaf, u):
+    """Trilinear interpolation of the bricks (k, n, n, n, 3) with indices leaf at the local
+    coordinates u (..., 3), measured in cells of the brick; leaf is broadcast against u[..., 0]"""
+    n = bricks.shape[1]
+    i0 = np.clip(np.floor(u).astype(int), 0, n - 2)
+    f = u - i0
+    value = 0
+    for dx in (0, 1):
+        wx = f[..., 0] if dx else 1 - f[..., 0]
+        for dy in (0, 1):
+            wy = f[..., 1] if dy else 1 - f[..., 1]
+            for dz in (0, 1):
+                wz = f[..., 2] if dz else 1 - f[..., 2]
+                corner = bricks[leaf, i0[..., 0] + dx, i0[..., 1] + dy, i0[..., 2] + dz]
+                value = value + (wx * wy * wz)[..., None] * corner
+
+    return value
+
+
+class FieldOctree:
+    """Octree of dA/dt samples of a wire path
+
+    Parameters
+    ----------
+    wire_path : np.ndarray
+        The points of the wire (mm), shape (n, 3)
+    limits : list
+        The [[x_min, x_max], [y_min, y_max], [z_min, z_max]] limits of the octree (mm)
+    tolerance : float
+        The largest error of the interpolation in a box relative to the largest |dA/dt| in it
+    min_spacing : float
+        The smallest spacing (mm) of the samples, boxes are not split below it
+    brick : int
+        The amount of samples along each side of a brick
+    didt : float
+        The rate of change of the current (A/s)
+    options :
+        Passed to vector_potential, e.g. method="treecode"
+    """
+
+    def __init__(
+        self,
+        wire_path,
+        limits,
+        tolerance: float = 1e-3,
+        min_spacing: float = 0.25,
+        brick: int = 9,
+        didt: float = 1.0,
+        **options,
+    ):
+        self.lower, self.upper = np.asarray(limits, dtype=float).T
+        self.brick = brick
+        t = np.linspace(0, 1, brick)
+        # Check points in the middle of the cells at the corners and the centre of the brick
+        cells = np.array((0, (brick - 2) // 2, brick - 2))
+        check = (cells + 0.5) / (brick - 1)
+
+        def field(points):
+            shape = points.shape
+            return (didt * vector_potential(wire_path, points.reshape(-1, 3), **options)).reshape(shape)
+
+        first_child, leaf_index, bricks, boxes = [], [], [], []
+        level_lower, level_upper = self.lower[None], self.upper[None]
+        level_nodes = np.array([0])
+        n_nodes = 1
+        while len(level_nodes):
+            samples = field(_brick_points(level_lower, level_upper, t))
+            exact = field(_brick_points(level_lower, level_upper, check))
+            u = np.broadcast_to(
+                np.stack(np.meshgrid(cells + 0.5, cells + 0.5, cells + 0.5, indexing="ij"), axis=-1),
+                exact.shape,
+            )
+            leaves = np.arange(len(samples))[:, None, None, None]
+            error = np.linalg.norm(_trilinear(samples, leaves, u) - exact, axis=-1)
+            error = error.reshape(len(exact), -1).max(axis=1)
+            scale = np.maximum(
+                np.linalg.norm(samples, axis=-1).reshape(len(samples), -1).max(axis=1),
+                np.linalg.norm(exact, axis=-1).reshape(len(exact), -1).max(axis=1),
+            )
+            spacing = (level_upper - level_lower).max(axis=1) / (brick - 1)
+            split = (error > tolerance * scale) & (spacing / 2 >= min_spacing)
+
+            first_child.extend([-1] * len(level_nodes))
+            leaf_index.extend([-1] * len(level_nodes))
+            for node, box_lower, box_upper, box_samples, is_split in zip(
+                level_nodes, level_lower, level_upper, samples, split
+            ):
+                if is_split:
+                    first_child[node] = n_nodes
+                    n_nodes += 8
+                else:
+                    leaf_index[node] = len(bricks)
+                    bricks.append(box_samples.astype(np.float32))
+                    boxes.append((box_lower, box_upper))
+
+            # Children in octant order, bit 0 along x, bit 1 along y and bit 2 along z
+            octant = ((np.arange(8)[:, None] >> np.arange(3)) & 1).astype(float)
+            half = (level_upper[split] - level_lower[split]) / 2
+            level_lower = (level_lower[split][:, None, :] + octant[None] * half[:, None, :]).reshape(-1, 3)
+            level_upper = level_lower + np.repeat(half, 8, axis=0)
+            level_nodes = (np.array(first_child)[level_nodes[split]][:, None] + np.arange(8)).ravel()
+
+        self.first_child = np.array(first_child)
+        self.leaf_index = np.array(leaf_index)
+        self.bricks = np.array(bricks, dtype=np.float32).reshape(-1, brick, brick, brick, 3)
+        self.leaf_lower = np.array([b[0] for b in boxes]).reshape(-1, 3)
+        self.leaf_upper = np.array([b[1] for b in boxes]).reshape(-1, 3)
+
+    @property
+    def nbytes(self):
+        """Memory used by the samples (bytes)"""
+        return self.bricks.nbytes
+
+    def __call__(self, points):
+        """Interpolates dA/dt (V/m) at a set of points (mm), shape (m, 3). Points outside the
+        limits get zero, as outside of a sampled grid."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        inside = np.all((points >= self.lower) & (points <= self.upper), axis=1)
+        p = points[inside]
+
+        # Walk all the points down the octree at the same time
+        node = np.zeros(len(p), dtype=int)
+        lower = np.broadcast_to(self.lower, p.shape).copy()
+        size = np.broadcast_to(self.upper - self.lower, p.shape).copy()
+        active = self.first_child[node] >= 0
+        while active.any():
+            size[active] /= 2
+            bits = p[active] > lower[active] + size[active]
+            node[active] = self.first_child[node[active]] + bits @ np.array((1, 2, 4))
+            lower[active] += bits * size[active]
+            active = self.first_child[node] >= 0
+
+        leaf = self.leaf_index[node]
+        u = (p - self.leaf_lower[leaf]) / (self.leaf_upper[leaf] - self.leaf_lower[leaf]) * (self.brick - 1)
+        values = np.zeros((len(points), 3))
+        values[inside] = _trilinear(self.bricks, leaf, u)
+
+        return values
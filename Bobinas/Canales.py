@@ -0,0 +1,101 @@
+"""
+Fields of the channels of a multi-channel array, such as the 4 elements of the SistEstL* stimulators.
+The dA/dt of every channel is sampled once for a unit dI/dt, through the cache of CacheCampo, and
+the field of any set of channel weights is their linear superposition, a single weighted sum of
+the stored grids. Steering the array does not need new wire paths nor new simulations.
+"""
+
+import numpy as np
+
+from CacheCampo import FieldCache
+from Campo import grid_axes, vector_potential
+from Simetria import channel_grids
+
+
+class ChannelFields:
+    """Unit fields of the channels of an array
+
+    Parameters
+    ----------
+    fields : np.ndarray
+        dA/dt (V/m) of every channel for dI/dt = 1 A/s, shape (M, ..., 3)
+    """
+
+    def __init__(self, fields):
+        self.fields = np.asarray(fields)
+
+    @classmethod
+    def on_grid(
+        cls,
+        wire_paths,
+        limits,
+        resolution,
+        cache: FieldCache = None,
+        processes: int = 1,
+        symmetric: bool = False,
+        windings=(),
+        **options,
+    ):
+        """Samples the unit field of every channel on a grid, see sample_grid
+
+        Parameters
+        ----------
+        wire_paths : np.ndarray
+            The windings of every channel (mm), shape (M, n, 3), e.g. from sistest_wire_paths
+        limits : list
+            The limits of the grid (mm)
+        resolution : list
+            The spacing of the grid (mm)
+        cache : FieldCache
+            The cache of sampled grids, the default cache if None
+        processes : int
+            The amount of worker processes used to sample each grid
+        symmetric : bool
+            Sample once the channels that are copies of each other and interpolate the rest,
+            see channel_grids, instead of sampling every channel
+        windings : list of int
+            Where the windings of a channel start after the first one, for symmetric, e.g. the
+            amount of points of the core from sistest_windings
+        options :
+            Passed to sample_grid
+        """
+        cache = FieldCache() if cache is None else cache
+        if symmetric:
+            return cls(channel_grids(wire_paths, limits, resolution, cache=cache, windings=windings, **options))
+        shape = tuple(len(axis) for axis in grid_axes(limits, resolution)) + (3,)
+        fields = np.empty((len(wire_paths),) + shape, dtype=np.float32)
+        for i, wire_path in enumerate(wire_paths):
+            fields[i] = cache.sample(wire_path, 1.0, limits, resolution, processes, **options)
+
+        return cls(fields)
+
+    @classmethod
+    def at_points(cls, wire_paths, points, **options):
+        """Computes the unit field of every channel at a set of points (mm), shape (m, 3),
+        options are passed to vector_potential"""
+        return cls(np.array([vector_potential(wire_path, points, **options) for wire_path in wire_paths]))
+
+    @property
+    def channels(self):
+        """The amount of channels"""
+        return len(self.fields)
+
+    def combine(self, weights, didt: float = 1.0):
+        """dA/dt (V/m) of the array with the channels driven at didt times their weights
+
+        Parameters
+        ----------
+        weights : np.ndarray
+            The weight of every channel, shape (M,), or of several settings, shape (k, M)
+        didt : float
+            The rate of change (A/s) of the current of a channel of weight 1
+
+        Returns
+        -------
+            The field, shape (..., 3) of the unit fields, with a leading k axis for several settings
+        """
+        weights = np.asarray(weights, dtype=self.fields.dtype) * didt
+        if weights.shape[-1] != self.channels:
+            raise ValueError(f"Expected {self.channels} weights per setting, got {weights.shape[-1]}")
+
+        return np.tensordot(weights, self.fields, axes=1)
@@ -0,0 +1,190 @@
+"""
+Check of the clearance between the windings of the coils. Two pieces of wire overlap when the
+distance between their centre lines is below the mean of their diameters, e.g. consecutive turns
+of a helix whose pitch h / N is smaller than the wire, or neighbouring elements of an array that
+cross each other. The candidate pairs of segments come from a k-d tree of points spread along
+runs of consecutive segments about half a wire diameter long, so a finely sampled wire does not
+pair every segment with the many segments next to it along the wire. The check is O(n log n) and
+runs before the casing generation and the field sampling.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def segment_distances(p1, q1, p2, q2):
+    """Smallest distances between the segments p1-q1 and p2-q2, shape (k,) for (k, 3) ends"""
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.sum(d1 * d1, axis=1)
+    e = np.sum(d2 * d2, axis=1)
+    b = np.sum(d1 * d2, axis=1)
+    c = np.sum(d1 * r, axis=1)
+    f = np.sum(d2 * r, axis=1)
+    eps = 1e-12 * np.maximum(1.0, np.maximum(a, e))
+    a_safe = np.where(a > eps, a, 1)
+    e_safe = np.where(e > eps, e, 1)
+
+    # Closest points of the infinite lines, clamped to the first segment
+    denominator = a * e - b * b
+    s = np.where(denominator > eps * np.maximum(a, e), (b * f - c * e) / np.where(denominator > 0, denominator, 1), 0)
+    s = np.where(a > eps, np.clip(s, 0, 1), 0)
+    # Closest point of the second segment to it, and back to the first one when it is clamped
+    t = np.where(e > eps, (b * s + f) / e_safe, 0)
+    below, above = t < 0, t > 1
+    t = np.clip(t, 0, 1)
+    s = np.where(below & (a > eps), np.clip(-c / a_safe, 0, 1), s)
+    s = np.where(above & (a > eps), np.clip((b - c) / a_safe, 0, 1), s)
+
+    return np.linalg.norm(r + s[:, None] * d1 - t[:, None] * d2, axis=1)
+
+
+def clearance_violations(wire_paths, wire_diam, first: bool = False, block: int = 2**14):
+    """Finds the pairs of segments closer than the diameter of the wire
+
+    Parameters
+    ----------
+    wire_paths : list of np.ndarray
+        The points of every wire (mm), shape (n, 3) each, e.g. the windings of a coil or the
+        (M, P, 3) windings of the elements of an array
+    wire_diam : float or list
+        The diameter of the wire (mm), or of every wire, or of every point of every wire
+    first : bool
+        Stop at the first block of the wires with violations instead of finding all of them
+    block : int
+        The amount of points along the wires whose neighbours are searched at once
+
+    Returns
+    -------
+    wires : np.ndarray
+        The wires of every violation, shape (k, 2)
+    segments : np.ndarray
+        The segments of every violation, indices within their wire, shape (k, 2)
+    distance : np.ndarray
+        The distance between the centre lines of the segments (mm), shape (k,)
+    required : np.ndarray
+        The smallest distance allowed for them, the mean of their diameters (mm), shape (k,)
+    """
+    start, end, wire, index, diam, arc = [], [], [], [], [], []
+    diameters = [wire_diam] * len(wire_paths) if np.isscalar(wire_diam) else list(wire_diam)
+    for i, wire_path in enumerate(wire_paths):
+        wire_path = np.asarray(wire_path, dtype=float)
+        n = len(wire_path) - 1
+        start.append(wire_path[:-1])
+        end.append(wire_path[1:])
+        wire.append(np.full(n, i))
+        index.append(np.arange(n))
+        d = np.broadcast_to(np.asarray(diameters[i], dtype=float), (len(wire_path),))
+        diam.append(np.maximum(d[:-1], d[1:]))
+        # Length along the wire at the start of every segment
+        lengths = np.linalg.norm(wire_path[1:] - wire_path[:-1], axis=1)
+        arc.append(np.concatenate(([0.0], np.cumsum(lengths))))
+    start, end = np.concatenate(start), np.concatenate(end)
+    wire, index, diam = np.concatenate(wire), np.concatenate(index), np.concatenate(diam)
+    offsets = np.cumsum([0] + [len(a) for a in arc])
+    arc = np.concatenate(arc)
+    # Length along the wire at the start and at the end of every segment
+    arc_start = arc[offsets[wire] + index]
+    arc_end = arc[offsets[wire] + index + 1]
+
+    # Consecutive segments of a wire are joined into runs of about half the largest diameter h,
+    # segments longer than that are runs of their own. Every piece of a run is within deviation
+    # of its chord, so the runs are searched through their chords and a run of short segments
+    # has a handful of neighbours along its own wire instead of one per segment
+    h = diam.max(initial=0)
+    length = arc_end - arc_start
+    run_length = h / 2 if h > 0 else np.inf
+    long = length >= run_length
+    new_run = np.ones(len(start), dtype=bool)
+    new_run[1:] = (
+        (wire[1:] != wire[:-1]) | long[1:] | long[:-1]
+        | (np.floor(arc_start[1:] / run_length) != np.floor(arc_start[:-1] / run_length))
+    )
+    run = np.cumsum(new_run) - 1
+    run_first = np.flatnonzero(new_run)
+    run_last = np.append(run_first[1:], len(start)) - 1
+    count = run_last - run_first + 1
+    chord_start, chord_end = start[run_first], end[run_last]
+    deviation = np.zeros(len(run_first))
+    for points in (start, end):
+        np.maximum.at(deviation, run, segment_distances(points, points, chord_start[run], chord_end[run]))
+    run_diam = np.maximum.reduceat(diam, run_first) if len(run_first) else np.zeros(0)
+    run_thinnest = np.minimum.reduceat(diam, run_first) if len(run_first) else np.zeros(0)
+
+    # Points along every chord at most h apart: two pieces of wire closer than h have chords closer
+    # than h plus their deviations, so two of those points are closer than 2 h plus the deviations
+    chord_length = np.linalg.norm(chord_end - chord_start, axis=1)
+    pieces = np.maximum(1, np.ceil(chord_length / h).astype(int)) if h > 0 else np.ones(len(run_first), dtype=int)
+    owner = np.repeat(np.arange(len(run_first)), pieces)
+    t = (np.arange(len(owner)) - np.repeat(np.cumsum(pieces) - pieces, pieces) + 0.5) / pieces[owner]
+    samples = chord_start[owner] + t[:, None] * (chord_end - chord_start)[owner]
+    tree = cKDTree(samples)
+    radius = 2 * h + 2 * deviation.max(initial=0)
+
+    found = []
+    for b0 in range(0, len(samples), block):
+        near = cKDTree(samples[b0:b0 + block]).sparse_distance_matrix(tree, radius, output_type="ndarray")
+        pairs = np.stack((owner[b0 + near["i"]], owner[near["j"]]), axis=1)
+        # Every pair of runs once, with the earlier run first, and every run with itself
+        pairs = np.unique(pairs[pairs[:, 0] <= pairs[:, 1]], axis=0)
+        ri, rj = pairs[:, 0], pairs[:, 1]
+
+        # Runs of the same wire whose segments are all closer along the wire than twice the
+        # clearance are skipped before their segments are paired, see the gap below
+        same = wire[run_first[ri]] == wire[run_first[rj]]
+        widest_gap = arc_start[run_last[rj]] - arc_end[run_first[ri]]
+        keep = ~same | (widest_gap >= run_thinnest[ri] + run_thinnest[rj])
+        # Runs whose chords are farther apart than the clearance plus their deviations cannot overlap
+        chords = segment_distances(chord_start[ri], chord_end[ri], chord_start[rj], chord_end[rj])
+        keep &= chords < (run_diam[ri] + run_diam[rj]) / 2 + deviation[ri] + deviation[rj]
+        ri, rj = ri[keep], rj[keep]
+
+        # The pairs of segments of the remaining runs
+        n_pairs = count[ri] * count[rj]
+        pair_run = np.repeat(np.arange(len(ri)), n_pairs)
+        k = np.arange(len(pair_run)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        i = run_first[ri][pair_run] + k // count[rj][pair_run]
+        j = run_first[rj][pair_run] + k % count[rj][pair_run]
+        i, j = i[i < j], j[i < j]
+        required = (diam[i] + diam[j]) / 2
+
+        # Neighbouring segments of the same wire are always close. Pairs whose gap along the wire
+        # is below twice the clearance are skipped, a bend would need a radius below the wire to overlap
+        same = wire[i] == wire[j]
+        gap = arc_start[j] - arc_end[i]
+        keep = ~same | (gap >= 2 * required)
+        i, j, required = i[keep], j[keep], required[keep]
+
+        distance = segment_distances(start[i], end[i], start[j], end[j])
+        close = distance < required
+        found.append((i[close], j[close], distance[close], required[close]))
+        if first and np.any(close):
+            break
+
+    i, j, distance, required = (np.concatenate(x) for x in zip(*found)) if found else [np.zeros(0)] * 4
+    # A pair can be found from the points of both of its segments
+    _, unique = np.unique(np.stack((i, j), axis=1), axis=0, return_index=True)
+    i, j, distance, required = i[unique], j[unique], distance[unique], required[unique]
+    order = np.argsort(distance / required)
+    i, j = i[order].astype(int), j[order].astype(int)
+
+    return (
+        np.stack((wire[i], wire[j]), axis=1),
+        np.stack((index[i], index[j]), axis=1),
+        distance[order],
+        required[order],
+    )
+
+
+def check_clearance(wire_paths, wire_diam, name: str = "The windings"):
+    """Raises a ValueError if any two pieces of wire are closer than their diameter, see
+    clearance_violations; it stops at the first block of the wires with violations and the
+    message reports the worst one in it"""
+    wires, segments, distance, required = clearance_violations(wire_paths, wire_diam, first=True, block=2**10)
+    if len(distance):
+        raise ValueError(
+            f"{name} overlap: segment {segments[0, 0]} of wire {wires[0, 0]} and segment "
+            f"{segments[0, 1]} of wire {wires[0, 1]} are {distance[0]:.3g} mm apart for a "
+            f"clearance of {required[0]:.3g} mm, with at least {len(distance)} pairs of segments overlapping"
+        )
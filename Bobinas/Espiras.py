@@ -0,0 +1,208 @@
+"""
+Fast field of the uniform helices of the coils, as stacks of coaxial circular loops.
+The vector potential of a circular loop has a closed form with the complete elliptic integrals,
+so the full turns of a helix cost a few loops per turn instead of the many straight segments per
+turn that the wire path needs. The current of a helix also advances along its axis by the height of
+the helix, which the loops miss: that pitch correction is added as the field of a straight
+current along the axis, seen from the radius of the helix by the points inside it.
+The result is compared with the line segments of the same coil by loop_stack_error.
+"""
+
+import numpy as np
+from scipy.special import ellipe, ellipk
+
+from Campo import MU0, _block_sizes, max_memory, vector_potential
+from Geometria import adaptive_segment_count, figure_of_wire_path
+
+
+def loop_potential(radio: float, heights, weights, points, memory: int = None):
+    """Vector potential (T m) of coaxial circular loops around the z axis, for a current of 1 A
+    counterclockwise seen from +z times the weight of every loop
+
+    Parameters
+    ----------
+    radio : float
+        The radius of the loops (mm)
+    heights : np.ndarray
+        The z of every loop (mm), shape (k,)
+    weights : np.ndarray
+        The current of every loop relative to 1 A, shape (k,)
+    points : np.ndarray
+        The target points (mm), relative to the axis of the loops, shape (m, 3)
+    memory : int
+        The memory (bytes) used by the temporary arrays, max_memory if None
+
+    Returns
+    -------
+        The vector potential, shape (m, 3)
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    heights = np.asarray(heights, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    rho = np.hypot(points[:, 0], points[:, 1])
+    memory = max_memory if memory is None else memory
+    loop_block, point_block = _block_sizes(len(heights), len(points), memory)
+
+    a_phi = np.zeros(len(points))
+    for i in range(0, len(points), point_block):
+        r = rho[i:i + point_block, None]
+        for j in range(0, len(heights), loop_block):
+            dz = points[i:i + point_block, 2, None] - heights[None, j:j + loop_block]
+            m = 4 * radio * r / ((radio + r) ** 2 + dz**2)
+            # Points on the loops are singular, they are moved away by a tiny amount
+            m = np.minimum(m, 1 - 1e-15)
+            k = np.sqrt(m)
+            value = ((1 - m / 2) * ellipk(m) - ellipe(m)) / np.where(k > 0, k, 1) * np.sqrt(radio / np.where(r > 0, r, 1))
+            a_phi[i:i + point_block] += np.where(r[:, 0] > 0, value @ weights[j:j + loop_block], 0)
+
+    a_phi *= MU0 / np.pi
+    phi = np.arctan2(points[:, 1], points[:, 0])
+
+    return a_phi[:, None] * np.stack((-np.sin(phi), np.cos(phi), np.zeros_like(phi)), axis=1)
+
+
+def helix_potential(radio: float, N: float, h: float, points, loops_per_turn: int = 1, memory: int = None):
+    """Vector potential (T m) of the helix of spiral for a current of 1 A, as a stack of loops
+
+    Parameters
+    ----------
+    radio : float
+        The radius of the helix (mm)
+    N : float
+        The turns of the helix
+    h : float
+        The height of the helix (mm), it goes down from z=0 to z=-h
+    points : np.ndarray
+        The target points (mm), relative to the top of the axis of the helix, shape (m, 3)
+    loops_per_turn : int
+        The amount of loops that represent every full turn, each with its share of the current.
+        The last partial turn, if any, is summed as line segments
+    memory : int
+        The memory (bytes) used by the temporary arrays, max_memory if None
+
+    Returns
+    -------
+        The vector potential, shape (m, 3)
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    pitch = h / N
+    full = int(np.floor(N))
+    a = np.zeros((len(points), 3))
+    if full > 0:
+        # Loops at the middle of equal slices of the height of the full turns
+        n = full * loops_per_turn
+        heights = -pitch * full * (np.arange(n) + 0.5) / n
+        a += loop_potential(radio, heights, np.full(n, 1 / loops_per_turn), points, memory)
+
+        # Pitch correction: the current also goes down the axis by the height of the full turns.
+        # Outside the helix it acts as a current on the axis, inside it the field of a current on a
+        # cylinder barely changes with the distance to the axis, so those points are seen from the radius
+        rho = np.hypot(points[:, 0], points[:, 1])
+        clamped = np.stack((np.maximum(rho, radio), np.zeros_like(rho), points[:, 2]), axis=1)
+        a += vector_potential(np.array(((0.0, 0.0, 0.0), (0.0, 0.0, -pitch * full))), clamped, memory=memory)
+
+    if N > full:
+        # The last partial turn is not a loop, it is summed as line segments
+        phi = np.linspace(2 * np.pi * full, 2 * np.pi * N, max(2, int(np.ceil(64 * (N - full))) + 1))
+        arc = np.stack((radio * np.cos(phi), radio * np.sin(phi), -pitch * phi / (2 * np.pi)), axis=1)
+        a += vector_potential(arc, points, memory=memory)
+
+    return a
+
+
+def figure_of_potential(
+    radio: float,
+    N: float,
+    h: float,
+    radio2: float,
+    N2: float,
+    h2: float,
+    element_distance: float,
+    winding_casing_distance: float,
+    points,
+    loops_per_turn: int = 1,
+    memory: int = None,
+):
+    """Vector potential (T m) of the windings of figure_of_wire_path for a current of 1 A, with
+    the coil and the core as stacks of loops, see helix_potential. The straight segment that joins
+    the end of the core to the start of the coil is summed as a segment.
+
+    Returns
+    -------
+        The vector potential at the points (mm), shape (m, 3)
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    position = np.array((-element_distance / 2, 0, -winding_casing_distance))
+    local = points - position
+    # After np.fliplr both helices go down counterclockwise, as spiral does
+    a = helix_potential(radio, N, h, local, loops_per_turn, memory)
+    a += helix_potential(radio2, N2, h2, local, loops_per_turn, memory)
+
+    phi2 = 2 * np.pi * N2
+    core_end = np.array((radio2 * np.cos(phi2), radio2 * np.sin(phi2), -h2))
+    coil_start = np.array((radio, 0.0, 0.0))
+    a += vector_potential(np.stack((core_end, coil_start)), local, memory=memory)
+
+    return a
+
+
+def loop_stack_error(
+    radio: float,
+    N: float,
+    h: float,
+    radio2: float,
+    N2: float,
+    h2: float,
+    element_distance: float,
+    winding_casing_distance: float,
+    points,
+    loops_per_turn: int = 1,
+    tolerance: float = 1e-4,
+    samples: int = 64,
+    seed: int = 0,
+    **options,
+):
+    """Estimates the error of figure_of_potential against the line segments of the same windings
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The target points (mm), shape (m, 3), a random subset of them is checked
+    loops_per_turn : int
+        See helix_potential
+    tolerance : float
+        The relative field error used to choose the segments per turn of the reference, see
+        adaptive_segment_count
+    samples : int
+        The amount of points checked
+    seed : int
+        The seed of the random subset
+    options :
+        Passed to vector_potential for the reference
+
+    Returns
+    -------
+        The largest error at the checked points, relative to the largest |A| among them
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    rng = np.random.default_rng(seed)
+    check = points[rng.choice(len(points), min(samples, len(points)), replace=False)]
+
+    wire_path = figure_of_wire_path(
+        radio,
+        N,
+        h,
+        radio2,
+        N2,
+        h2,
+        adaptive_segment_count(N, tolerance),
+        adaptive_segment_count(N2, tolerance),
+        element_distance,
+        winding_casing_distance,
+    )
+    reference = vector_potential(wire_path, check, **options)
+    loops = figure_of_potential(
+        radio, N, h, radio2, N2, h2, element_distance, winding_casing_distance, check, loops_per_turn
+    )
+
+    return np.linalg.norm(loops - reference, axis=1).max() / np.linalg.norm(reference, axis=1).max()
@@ -0,0 +1,364 @@
+"""
+Parametric geometry of the coils used in the ModeladoL* and SistEstL* scripts.
+The windings are reconstructed with line segments exactly as in those scripts, but the
+turns and height of every helix are arguments instead of being hard-coded in each copy.
+"""
+
+import numpy as np
+
+
+def segments_per_turn(tolerance: float, radio: float = None, distance: float = None):
+    """Amount of line segments per turn needed to reach a relative field accuracy.
+
+    A turn drawn with n straight segments is a regular polygon inscribed in the circle of the
+    helix. At the centre of the turn the field of the polygon is n tan(pi/n) / pi times the field
+    of the circle, a relative error close to pi^2 / (3 n^2). At a distance d of the wire the error
+    is driven by the sagitta of the segments, close to pi^2 r / (2 n^2 d).
+
+    Parameters
+    ----------
+    tolerance : float
+        The relative error allowed in the field
+    radio : float
+        The radius of the helix (mm), only needed with distance
+    distance : float
+        The smallest distance (mm) from the wire where the field has to be accurate. The error
+        is estimated at the centre of the turns if None
+
+    Returns
+    -------
+        The amount of segments per turn, at least 8
+    """
+    factor = 2 / 3 if distance is None else max(2 / 3, radio / distance)
+    return max(8, int(np.ceil(np.pi * np.sqrt(factor / (2 * tolerance)))))
+
+
+def adaptive_segment_count(N: float, tolerance: float, radio: float = None, distance: float = None):
+    """Amount of points of a helix of N turns with the segments per turn given by segments_per_turn.
+    The result can be used as the segment_count of spiral and spiral2.
+    """
+    return int(np.ceil(N * segments_per_turn(tolerance, radio, distance))) + 1
+
+
+# Each function spiral is to create a helix, spiral for the coil and spiral2 for the core
+def spiral(radio: float, N: float, h: float, segment_count: int):
+    """Creates the helical path of the coil, going down from z=0 to z=-h.
+
+    Parameters
+    ----------
+    radio : float
+        The radius of the helix (mm)
+    N : float
+        The turns of the helix
+    h : float
+        The height of the helix (mm)
+    segment_count : int
+        The amount of segments used to represent the helix
+
+    Returns
+    -------
+        The wire path of the helix, shape (3, segment_count)
+    """
+    # Evenly spaced angles
+    phi = np.linspace(0, 2 * np.pi * N, segment_count)
+    # Coil pitch
+    pitch = -h / (2 * np.pi * N)
+    # Calculates the cartesian coordinates of the helix
+    path = np.array(
+        [radio * np.cos(phi), radio * np.sin(phi), pitch * phi]
+    )
+
+    return path
+
+
+def spiral2(radio2: float, N2: float, h2: float, segment_count2: int):
+    """Creates the helical path of the core, going up from z=-h2 to z=0.
+
+    Parameters
+    ----------
+    radio2 : float
+        The radius of the helix (mm)
+    N2 : float
+        The turns of the helix
+    h2 : float
+        The height of the helix (mm)
+    segment_count2 : int
+        The amount of segments used to represent the helix
+
+    Returns
+    -------
+        The wire path of the helix, shape (3, segment_count2)
+    """
+    # Evenly spaced angles
+    phi = np.linspace(2 * np.pi * N2, 0, segment_count2)
+    # Coil pitch
+    pitch2 = -h2 / (2 * np.pi * N2)
+    # Calculates the cartesian coordinates of the helix
+    path = np.array(
+        [radio2 * np.cos(phi), radio2 * np.sin(phi), pitch2 * phi]
+    )
+
+    return path
+
+
+def _helix_derivatives(radio: float, N: float, h: float, phi):
+    """Derivatives of the points of a helix at the angles phi with respect to its radius, turns
+    and height, shape (3, 3, segment_count). The angles span 2 pi N, so phi / N is fixed when N
+    changes, and so is the height pitch * phi of every point."""
+    zero = np.zeros_like(phi)
+    return np.array(
+        [
+            [np.cos(phi), np.sin(phi), zero],
+            [-radio * np.sin(phi) * phi / N, radio * np.cos(phi) * phi / N, zero],
+            [zero, zero, -phi / (2 * np.pi * N)],
+        ]
+    )
+
+
+def spiral_derivatives(radio: float, N: float, h: float, segment_count: int):
+    """Derivatives of the wire path of spiral with respect to radio, N and h, shape (3, 3, segment_count)"""
+    return _helix_derivatives(radio, N, h, np.linspace(0, 2 * np.pi * N, segment_count))
+
+
+def spiral2_derivatives(radio2: float, N2: float, h2: float, segment_count2: int):
+    """Derivatives of the wire path of spiral2 with respect to radio2, N2 and h2, shape (3, 3, segment_count2)"""
+    return _helix_derivatives(radio2, N2, h2, np.linspace(2 * np.pi * N2, 0, segment_count2))
+
+
+def figure_of_wire_path(
+    radio: float,
+    N: float,
+    h: float,
+    radio2: float,
+    N2: float,
+    h2: float,
+    segment_count: int,
+    segment_count2: int,
+    element_distance: float,
+    winding_casing_distance: float,
+):
+    """Generates the windings of a coil with its core
+
+    Parameters
+    ----------
+    radio : float
+        The radius of the coil (mm)
+    N : float
+        The turns of the coil
+    h : float
+        The height of the coil (mm)
+    radio2 : float
+        The radius of the core (mm)
+    N2 : float
+        The turns of the core
+    h2 : float
+        The height of the core (mm)
+    segment_count : int
+        The amount of segments used to represent the coil
+    segment_count2 : int
+        The amount of segments used to represent the core
+    element_distance : float
+        The center to center distance of the two spirals
+    winding_casing_distance : float
+        The distance of the casing to the windings of the coil
+
+    Returns
+    -------
+        The windings of the coil, shape (segment_count + segment_count2, 3)
+    """
+    # Global position of the coil and the core
+    position = np.array((-element_distance / 2, 0, -winding_casing_distance))[:, None]
+
+    # Generate the spirals of the coil and the core
+    spiral_1 = spiral(radio, N, h, segment_count) + position
+    spiral_2 = np.fliplr(spiral2(radio2, N2, h2, segment_count2) + position)
+
+    return np.concatenate(
+        (
+            spiral_2,
+            spiral_1,
+        ),
+        axis=1,
+    ).T
+
+
+def figure_of_wire_path_derivatives(
+    radio: float,
+    N: float,
+    h: float,
+    radio2: float,
+    N2: float,
+    h2: float,
+    segment_count: int,
+    segment_count2: int,
+):
+    """Derivatives of the windings of figure_of_wire_path with respect to radio, N, h, radio2, N2
+    and h2, in that order, shape (6, segment_count + segment_count2, 3). The position of the
+    windings does not depend on these parameters."""
+    derivatives = np.zeros((6, segment_count2 + segment_count, 3))
+    # The core comes first, reversed as by np.fliplr
+    derivatives[3:, :segment_count2] = spiral2_derivatives(radio2, N2, h2, segment_count2)[:, :, ::-1].transpose(0, 2, 1)
+    derivatives[:3, segment_count2:] = spiral_derivatives(radio, N, h, segment_count).transpose(0, 2, 1)
+
+    return derivatives
+
+
+def spiral_chunks(
+    radio: float,
+    N: float,
+    h: float,
+    segment_count: int,
+    chunk_size: int = 2**16,
+    position=(0, 0, 0),
+    first_size: int = None,
+):
+    """Yields the points of the helix of spiral in chunks instead of as one array, so that the
+    memory stays bounded for any segment_count. Every chunk holds at most chunk_size segments and
+    starts with the last point of the previous chunk.
+
+    Parameters
+    ----------
+    radio, N, h, segment_count :
+        As in spiral
+    chunk_size : int
+        The largest amount of segments in a chunk
+    position : tuple
+        Added to every point (mm)
+    first_size : int
+        The largest amount of segments in the first chunk, chunk_size if None
+
+    Yields
+    ------
+        The points of the chunk (mm), shape (k, 3)
+    """
+    # Same angles as np.linspace(0, 2 * pi * N, segment_count)
+    step = 2 * np.pi * N / (segment_count - 1)
+    pitch = -h / (2 * np.pi * N)
+    i0, size = 0, chunk_size if first_size is None else first_size
+    while i0 < segment_count - 1:
+        i1 = min(i0 + size, segment_count - 1)
+        phi = np.arange(i0, i1 + 1) * step
+        chunk = np.empty((len(phi), 3))
+        chunk[:, 0] = radio * np.cos(phi)
+        chunk[:, 1] = radio * np.sin(phi)
+        chunk[:, 2] = pitch * phi
+        chunk += position
+        yield chunk
+        i0, size = i1, chunk_size
+
+
+def figure_of_wire_path_chunks(
+    radio: float,
+    N: float,
+    h: float,
+    radio2: float,
+    N2: float,
+    h2: float,
+    segment_count: int,
+    segment_count2: int,
+    element_distance: float,
+    winding_casing_distance: float,
+    chunk_size: int = 2**16,
+):
+    """Yields the windings of figure_of_wire_path in chunks of at most chunk_size segments, see
+    spiral_chunks. The chunks of the core come first; the first chunk of the coil starts with the
+    last point of the core, so that the segment joining both windings is kept, and holds one
+    segment of the coil less to stay within chunk_size."""
+    position = (-element_distance / 2, 0, -winding_casing_distance)
+    # spiral2 reversed by np.fliplr goes through the same points as spiral
+    last = None
+    for chunk in spiral_chunks(radio2, N2, h2, segment_count2, chunk_size, position):
+        last = chunk[-1]
+        yield chunk
+    first_size = None if last is None else max(1, chunk_size - 1)
+    for i, chunk in enumerate(spiral_chunks(radio, N, h, segment_count, chunk_size, position, first_size)):
+        yield np.concatenate((last[None], chunk)) if i == 0 and last is not None else chunk
+
+
+def write_wire_path(chunks, fn: str, n_points: int):
+    """Writes the points of a wire path given in chunks to a .npy file, without joining them in memory
+
+    Parameters
+    ----------
+    chunks : iterable of np.ndarray
+        The chunks of the wire path, every chunk after the first starting with the last point of
+        the previous one, as yielded by figure_of_wire_path_chunks
+    fn : str
+        The path of the .npy file
+    n_points : int
+        The amount of points of the wire path, e.g. segment_count + segment_count2
+
+    Returns
+    -------
+        The wire path, memory-mapped from the file, shape (n_points, 3)
+    """
+    wire_path = np.lib.format.open_memmap(fn, mode="w+", dtype=np.float64, shape=(n_points, 3))
+    i = 0
+    for chunk in chunks:
+        chunk = chunk if i == 0 else chunk[1:]
+        wire_path[i:i + len(chunk)] = chunk
+        i += len(chunk)
+    if i != n_points:
+        raise ValueError(f"The chunks hold {i} points, expected {n_points}")
+    wire_path.flush()
+
+    return wire_path
+
+
+def _rotations_from_z(axes):
+    """Rotation matrices that take the z axis onto every axis, shape (M, 3, 3)"""
+    axes = np.asarray(axes, dtype=float)
+    axes = axes / np.linalg.norm(axes, axis=-1, keepdims=True)
+    # Rodrigues formula with v = z x axis and c = z . axis
+    c = axes[:, 2]
+    vx = np.zeros((len(axes), 3, 3))
+    vx[:, 0, 2] = axes[:, 0]
+    vx[:, 1, 2] = axes[:, 1]
+    vx[:, 2, 0] = -axes[:, 0]
+    vx[:, 2, 1] = -axes[:, 1]
+    antiparallel = np.isclose(c, -1)
+    scale = np.where(antiparallel, 0, 1 / np.where(antiparallel, 1, 1 + c))
+    rotations = np.eye(3) + vx + np.einsum("mij,mjk->mik", vx, vx) * scale[:, None, None]
+    # Half turn about the x axis when the element points down
+    rotations[antiparallel] = np.diag((1.0, -1.0, -1.0))
+
+    return rotations
+
+
+def array_wire_paths(element_path, centres, axes=None, directions=None, reverse_from: int = 0):
+    """Places a copy of an element at every position of an array of elements
+
+    Parameters
+    ----------
+    element_path : np.ndarray
+        The windings of one element centred at the origin with its axis along z, shape (P, 3)
+    centres : np.ndarray
+        The centre of every element (mm), shape (M, 3)
+    axes : np.ndarray
+        The axis of every element, shape (M, 3). Every element points along z if None
+    directions : np.ndarray
+        The winding direction of every element, +1 or -1, shape (M,). A negative direction
+        reverses the order of the points of the element from reverse_from on
+    reverse_from : int
+        The first point reversed by a negative direction. With the core before the coil, the
+        amount of points of the core, so that only the coil is reversed as np.fliplr does in the
+        SistEstL* scripts
+
+    Returns
+    -------
+        The windings of every element, shape (M, P, 3)
+    """
+    element_path = np.asarray(element_path, dtype=float)
+    centres = np.atleast_2d(np.asarray(centres, dtype=float))
+
+    if axes is None:
+        paths = element_path[None, :, :] + centres[:, None, :]
+    else:
+        rotations = _rotations_from_z(np.atleast_2d(axes))
+        paths = np.einsum("mij,pj->mpi", rotations, element_path) + centres[:, None, :]
+
+    if directions is not None:
+        reverse = np.asarray(directions) < 0
+        paths[reverse, reverse_from:] = paths[reverse, reverse_from:][:, ::-1]
+
+    return paths
@@ -0,0 +1,100 @@
+"""
+Self and mutual inductances of wire paths with the Neumann formula,
+L_pq = mu0 / 4 pi sum over the segments i of p and j of q of the integral of dl_i . dl_j / |r_i - r_j|.
+The inner integral over every segment j is the closed form of its vector potential (see Campo) and
+the outer one over every segment i is a Gauss-Legendre quadrature, so the whole sum is one field
+evaluation at the quadrature points. The points are taken on the surface of the wire, at the geometric
+mean radius of its cross section, which keeps the terms of a segment with itself and with its
+neighbours finite and gives the low frequency inductance of a round wire, internal part included.
+"""
+
+import argparse
+
+import numpy as np
+
+from Campo import vector_potential, wire_segments
+
+
+def _quadrature_points(wire_path, wire_diam: float, order: int):
+    """Quadrature points on the surface of the wire and their weighted dl (mm), shape (n * 2 * order, 3)"""
+    start, end = wire_segments(wire_path)
+    dl = end - start
+    direction = dl / np.linalg.norm(dl, axis=1, keepdims=True)
+    # Any direction perpendicular to the segment, from the axis least aligned with it
+    axis = np.eye(3)[np.argmin(np.abs(direction), axis=1)]
+    normal = np.cross(direction, axis)
+    normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+    # Geometric mean distance of a round wire from itself
+    offset = normal * wire_diam / 2 * np.exp(-0.25)
+
+    t, w = np.polynomial.legendre.leggauss(order)
+    t, w = (t + 1) / 2, w / 2
+    centre = start[:, None, :] + t[None, :, None] * dl[:, None, :]
+    # On both sides of the wire, which cancels the first order error of the offset on curved wires
+    points = np.concatenate((centre + offset[:, None, :], centre - offset[:, None, :]), axis=1)
+    weights = np.tile(w[None, :, None] * dl[:, None, :] / 2, (1, 2, 1))
+
+    return points.reshape(-1, 3), weights.reshape(-1, 3)
+
+
+def inductance_matrix(wire_paths, wire_diam: float, order: int = 1, **options):
+    """Computes the self and mutual inductances of a set of wire paths
+
+    Parameters
+    ----------
+    wire_paths : list of np.ndarray
+        The points (mm) of every wire, shape (n, 3) each, e.g. the (M, P, 3) array of
+        array_wire_paths for the elements of an array
+    wire_diam : float
+        The diameter of the wire (mm)
+    order : int
+        The amount of Gauss-Legendre points on every segment
+    options :
+        Passed to vector_potential, e.g. method="treecode" for very long wires
+
+    Returns
+    -------
+        The inductance matrix (H), shape (M, M)
+    """
+    quadrature = [_quadrature_points(wire_path, wire_diam, order) for wire_path in wire_paths]
+    matrix = np.zeros((len(wire_paths), len(wire_paths)))
+    # The matrix is symmetric, only the upper triangle is evaluated
+    for q, wire_path in enumerate(wire_paths):
+        points = np.concatenate([quadrature[p][0] for p in range(q + 1)])
+        a = vector_potential(wire_path, points, **options)
+        first = 0
+        for p in range(q + 1):
+            weights = quadrature[p][1]
+            # Positions are in mm, 1e-3 converts dl into m
+            matrix[p, q] = matrix[q, p] = 1e-3 * np.sum(a[first:first + len(weights)] * weights)
+            first += len(weights)
+
+    return matrix
+
+
+def inductance(wire_path, wire_diam: float, order: int = 1, **options):
+    """Computes the inductance (H) of a single wire path, see inductance_matrix"""
+    return inductance_matrix([wire_path], wire_diam, order, **options)[0, 0]
+
+
+if __name__ == "__main__":
+    from ModeladoLote import COILS, coil_wire_path
+    from SistEstLote import SISTEST, sistest_wire_paths
+
+    parser = argparse.ArgumentParser(description="Prints the inductance matrix of a coil or of the elements of a stimulator")
+    parser.add_argument("name", choices=list(COILS) + list(SISTEST), help="Coil or stimulator")
+    parser.add_argument("--tolerance", type=float, default=None, help="Relative field error that sets the segments per turn")
+    parser.add_argument("--order", type=int, default=1, help="Gauss-Legendre points per segment")
+    args = parser.parse_args()
+
+    if args.name in SISTEST:
+        wire_paths = sistest_wire_paths(args.name, args.tolerance)
+        wire_diam = SISTEST[args.name]["wire_diam"]
+    else:
+        wire_paths = [coil_wire_path(args.name, args.tolerance)]
+        wire_diam = COILS[args.name]["wire_diam"]
+
+    matrix = inductance_matrix(wire_paths, wire_diam, args.order)
+    with np.printoptions(precision=4):
+        print(f"Inductance matrix (uH) of {args.name}:")
+        print(matrix * 1e6)
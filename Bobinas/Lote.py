@@ -0,0 +1,328 @@
+"""
+Batch building of the coils of the ModeladoLote and SistEstLote scripts.
+A CoilFamily holds what differs between the scripts: the parameters of its coils, the names of
+their tcd files and how their windings are generated. Building the coils in parallel, writing the
+tcd and nifti files, the manifest of Manifiesto and the command line are the same for every family.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import nibabel as nib
+import numpy as np
+from simnibs.simulation.tms_coil.tms_coil import TmsCoil
+
+from simnibs.simulation.tms_coil.tms_coil_element import LineSegmentElements
+from simnibs.simulation.tms_coil.tms_stimulator import TmsStimulator
+
+from CacheCampo import FieldCache
+from Campo import bounding_limits, grid_voxels
+from Colisiones import check_clearance
+from Manifiesto import build_stale
+from Parametros import didt, element_distance, limits, resolution, winding_casing_distance
+
+# The modules that generate the files of every family, besides the script of the family
+generator_modules = ["CacheCampo", "Campo", "Colisiones", "Geometria", "Lote", "Parametros"]
+
+
+def coil_limits(wire_path, name: str, limits_tolerance: float = None):
+    """Returns the limits of the a field of a coil: the fixed limits if limits_tolerance is None,
+    otherwise the bounding box of the windings plus the margin given by bounding_limits, which are
+    reported with the amount of voxels saved. The report says so when the fixed limits stopped the
+    margin before |A| fell to limits_tolerance"""
+    if limits_tolerance is None:
+        return limits
+
+    box, ratio = bounding_limits(wire_path, limits_tolerance, resolution, limits, full_output=True)
+    voxels, full = grid_voxels(box, resolution), grid_voxels(limits, resolution)
+    reached = ""
+    if ratio > limits_tolerance:
+        reached = f", tolerance not reached: |A| at the limits is {ratio:.2g} of the peak"
+    print(f"{name}: limits {box}, {voxels} voxels instead of {full} ({1 - voxels / full:.1%} saved){reached}")
+
+    return box
+
+
+def write_coil(wire_path, fn: str, field_limits=None):
+    """Creates a coil from its windings and writes it to a tcd file
+
+    Parameters
+    ----------
+    wire_path : np.ndarray
+        The windings of the coil, shape (n, 3), or of every channel of an array, shape (M, n, 3).
+        Every channel is written as its own element so that they can be driven separately
+    fn : str
+        The path of the tcd file
+    field_limits : list
+        The limits of the a field of the coil, the fixed limits if None
+    """
+    # Creating a example stimulator with a name, a brand and a maximum dI/dt
+    stimulator = TmsStimulator("Example Stimulator", "Example Stimulator Brand", didt)
+
+    # Creating the line segments from a list of wire path points, one element per channel
+    wire_path = np.asarray(wire_path)
+    if wire_path.ndim == 2:
+        elements = [LineSegmentElements(stimulator, wire_path, name="Figure_of_8")]
+    else:
+        elements = [
+            LineSegmentElements(stimulator, channel, name=f"Channel_{i + 1}")
+            for i, channel in enumerate(wire_path)
+        ]
+    # Creating the TMS coil with its elements, a name, a brand, a version, the limits and the resolution
+    tms_coil = TmsCoil(
+        elements,
+        "Example Coil",
+        "Example Coil Brand",
+        "V1.0",
+        limits if field_limits is None else field_limits,
+        resolution,
+    )
+
+    # Generating a coil casing that has a specified distance from the coil windings
+    tms_coil.generate_element_casings(
+        winding_casing_distance, winding_casing_distance / 2, False
+    )
+
+    # Write the coil to a tcd file
+    tms_coil.write(fn)
+
+
+def write_nifti(wire_path, fn: str, cache: FieldCache = None, field_limits=None, processes: int = 1):
+    """Samples dA/dt of a coil on the limits and resolution grid and writes it to a nifti file.
+    The grid is taken from the cache when the same wire path was already sampled.
+
+    Parameters
+    ----------
+    wire_path : np.ndarray
+        The windings of the coil, shape (n, 3), or of every channel of an array, shape (M, n, 3).
+        The grid of every channel is sampled and cached on its own and the grids are added
+    fn : str
+        The path of the nifti file
+    cache : FieldCache
+        The cache of sampled grids, the default cache if None
+    field_limits : list
+        The limits of the grid, the fixed limits if None
+    processes : int
+        The amount of worker processes used to sample each grid, see sample_grid
+    """
+    cache = FieldCache() if cache is None else cache
+    field_limits = limits if field_limits is None else field_limits
+    wire_path = np.asarray(wire_path)
+    if wire_path.ndim == 2:
+        grid = cache.sample(wire_path, didt, field_limits, resolution, processes)
+    else:
+        grid = sum(
+            np.asarray(cache.sample(channel, didt, field_limits, resolution, processes)) for channel in wire_path
+        )
+
+    affine = np.diag(np.append(np.asarray(resolution, dtype=float), 1))
+    affine[:3, 3] = [lo for lo, _ in field_limits]
+    nib.save(nib.Nifti1Image(np.asarray(grid), affine), fn)
+
+
+class CoilFamily:
+    """The coils built by one of the batch scripts
+
+    Parameters
+    ----------
+    table : dict
+        The parameters of every coil keyed on its name, with at least its wire_diam
+    kind : str
+        What a coil of the family is called in the messages, e.g. "coil" or "stimulator"
+    tcd_name : callable
+        Returns the name of the tcd file of a coil from its name
+    wire_path : callable
+        Returns the windings of a coil from its name and the tolerance, shape (n, 3), or of every
+        channel of an array, shape (M, n, 3)
+    segment_counts : callable
+        Returns the segments of the coil and of the core from the name and the tolerance
+    """
+
+    def __init__(self, table: dict, kind: str, tcd_name, wire_path, segment_counts):
+        self.table = table
+        self.kind = kind
+        self.tcd_name = tcd_name
+        self.wire_path = wire_path
+        self.segment_counts = segment_counts
+
+    def names(self, names=None):
+        """The names given, every coil of the table if None. Raises a ValueError for unknown names"""
+        names = list(self.table) if names is None else list(names)
+        unknown = [name for name in names if name not in self.table]
+        if unknown:
+            raise ValueError(f"Unknown {self.kind}s: {', '.join(unknown)}")
+
+        return names
+
+    def inputs(self, name: str, tolerance: float = None, nifti: bool = False, limits_tolerance: float = None):
+        """Returns everything the files of a coil depend on, for the manifest"""
+        return dict(
+            params=self.table[name],
+            segment_counts=self.segment_counts(name, tolerance),
+            element_distance=element_distance,
+            winding_casing_distance=winding_casing_distance,
+            limits=limits,
+            resolution=resolution,
+            didt=didt,
+            tolerance=tolerance,
+            nifti=nifti,
+            limits_tolerance=limits_tolerance,
+        )
+
+    def sources(self):
+        """Returns the source files that generate the coils: the generator_modules and the script
+        that defines the windings of the family"""
+        modules = generator_modules + [self.wire_path.__module__]
+        return [sys.modules[module].__file__ for module in modules if module in sys.modules]
+
+    def outputs(self, name: str, out_dir: str = ".", nifti: bool = False):
+        """Returns the paths of the files written by build_coil"""
+        fn = os.path.join(out_dir, self.tcd_name(name))
+        return [fn, os.path.splitext(fn)[0] + ".nii.gz"] if nifti else [fn]
+
+    def build_coil(
+        self,
+        name: str,
+        out_dir: str = ".",
+        tolerance: float = None,
+        nifti: bool = False,
+        limits_tolerance: float = None,
+        check: bool = False,
+        sample_processes: int = 1,
+    ):
+        """Creates a coil and writes it to a tcd file
+
+        Parameters
+        ----------
+        name : str
+            The name of the coil, one of the keys of the table
+        out_dir : str
+            The directory where the tcd file is written
+        tolerance : float
+            The relative field error used to choose the segments per turn, see adaptive_segment_count.
+            The fixed segment counts are used if None
+        nifti : bool
+            Whether dA/dt is also written to a nifti file next to the tcd file, see write_nifti
+        limits_tolerance : float
+            Derive the limits from the windings with this tolerance instead of using the fixed
+            limits, see coil_limits
+        check : bool
+            Reject the windings if any two pieces of wire are closer than the wire diameter, before
+            generating the casing and sampling the field, see check_clearance
+        sample_processes : int
+            The amount of worker processes used to sample the nifti grid, the amount of cores if None
+
+        Returns
+        -------
+            The path of the tcd file
+        """
+        outputs = self.outputs(name, out_dir, nifti)
+        wire_path = np.asarray(self.wire_path(name, tolerance))
+        if check:
+            check_clearance(wire_path if wire_path.ndim == 3 else [wire_path], self.table[name]["wire_diam"], name)
+        field_limits = coil_limits(wire_path.reshape(-1, 3), name, limits_tolerance)
+        write_coil(wire_path, outputs[0], field_limits)
+        if nifti:
+            write_nifti(wire_path, outputs[1], field_limits=field_limits, processes=sample_processes)
+
+        return outputs[0]
+
+    def build_all(self, names=None, out_dir: str = ".", processes=None, **options):
+        """Creates several coils in parallel and writes them to tcd files
+
+        Parameters
+        ----------
+        names : list of str
+            The names of the coils, every coil of the table if None
+        out_dir : str
+            The directory where the tcd files are written
+        processes : int
+            The amount of worker processes, the amount of cores if None
+        options :
+            Passed to build_coil: tolerance, nifti, limits_tolerance, check and sample_processes
+
+        Returns
+        -------
+            The paths of the tcd files, in the same order as names
+        """
+        names = self.names(names)
+        os.makedirs(out_dir, exist_ok=True)
+
+        with ProcessPoolExecutor(processes) as pool:
+            return list(pool.map(partial(self.build_coil, out_dir=out_dir, **options), names))
+
+    def build(
+        self,
+        names=None,
+        out_dir: str = ".",
+        processes=None,
+        tolerance: float = None,
+        nifti: bool = False,
+        limits_tolerance: float = None,
+        force: bool = False,
+        check: bool = False,
+        sample_processes: int = 1,
+    ):
+        """Builds the coils whose parameters changed since the last build in out_dir, see build_all
+        and build_coil for the parameters. The coils that are up to date are skipped unless force is True.
+
+        Returns
+        -------
+            The names of the coils that were built
+        """
+        return build_stale(
+            self.names(names),
+            partial(self.inputs, tolerance=tolerance, nifti=nifti, limits_tolerance=limits_tolerance),
+            partial(self.outputs, out_dir=out_dir, nifti=nifti),
+            partial(
+                self.build_all,
+                out_dir=out_dir,
+                processes=processes,
+                tolerance=tolerance,
+                nifti=nifti,
+                limits_tolerance=limits_tolerance,
+                check=check,
+                sample_processes=sample_processes,
+            ),
+            out_dir,
+            force,
+            self.sources(),
+        )
+
+    def main(self, description: str):
+        """Command line of a batch script: builds the coils given by name, every coil if none"""
+        parser = argparse.ArgumentParser(description=description)
+        parser.add_argument("names", nargs="*", help=f"{self.kind.capitalize()}s to build, every {self.kind} if empty")
+        parser.add_argument("--out-dir", default=".", help="Directory for the tcd files")
+        parser.add_argument("--processes", type=int, default=None, help="Amount of worker processes")
+        parser.add_argument(
+            "--tolerance", type=float, default=None,
+            help="Relative field error that sets the segments per turn, 600 segments per helix if not given",
+        )
+        parser.add_argument("--nifti", action="store_true", help="Also write dA/dt sampled on the grid to nifti files")
+        parser.add_argument(
+            "--auto-limits", type=float, default=None, metavar="TOLERANCE",
+            help="Derive the limits from the bounding box of the windings, |A| at the limits below TOLERANCE times |A| next to them",
+        )
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Reject the windings where two pieces of wire are closer than the wire diameter",
+        )
+        parser.add_argument(
+            "--sample-processes", type=int, default=1,
+            help="Worker processes sampling the nifti grid of each coil, keep processes times this near the cores",
+        )
+        parser.add_argument("--force", action="store_true", help=f"Build the {self.kind}s even if they are up to date")
+        args = parser.parse_args()
+
+        built = self.build(
+            args.names or None, args.out_dir, args.processes, args.tolerance, args.nifti, args.auto_limits, args.force,
+            args.check, args.sample_processes,
+        )
+        for name in built:
+            print(os.path.join(args.out_dir, self.tcd_name(name)))
+        if not built:
+            print(f"Every {self.kind} is up to date")
@@ -0,0 +1,115 @@
+"""
+Manifest of the files written by the ModeladoLote and SistEstLote scripts.
+For every coil it records the parameters the files were generated from, so a later build can
+tell which coils changed and regenerate only those, skipping the casing generation and the
+field sampling of the rest. The source files of the scripts that generate the coils are hashed
+along with the parameters, so editing them rebuilds every coil.
+"""
+
+import hashlib
+import json
+import os
+
+# Bump to rebuild every coil after a change the sources do not show, e.g. a new SimNIBS
+GENERATOR_VERSION = 2
+
+# Name of the manifest in the output directory
+manifest_name = "manifest.json"
+
+
+def source_hash(sources):
+    """Returns the sha256 of the contents of the source files, as a hex string"""
+    h = hashlib.sha256()
+    for fn in sorted(set(sources)):
+        with open(fn, "rb") as f:
+            h.update(os.path.basename(fn).encode())
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+def inputs_hash(inputs: dict, sources: str = None):
+    """Returns the sha256 of the inputs of a coil and of the source_hash of its generator, as a hex string"""
+    text = json.dumps(dict(version=GENERATOR_VERSION, sources=sources, inputs=inputs), sort_keys=True, default=float)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Manifest:
+    """Inputs and outputs of every coil built in a directory
+
+    Parameters
+    ----------
+    out_dir : str
+        The directory of the files, the manifest is read from and written to it
+    sources : list of str
+        The source files that generate the coils, see source_hash
+    """
+
+    def __init__(self, out_dir: str = ".", sources=()):
+        self.fn = os.path.join(out_dir, manifest_name)
+        self.sources = source_hash(sources)
+        try:
+            with open(self.fn) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def stale(self, name: str, inputs: dict, outputs):
+        """Whether a coil has to be rebuilt: it was never built, its inputs or the sources changed or
+        one of its outputs is missing"""
+        entry = self.entries.get(name)
+        if entry is None or entry["hash"] != inputs_hash(inputs, self.sources):
+            return True
+
+        return not all(os.path.exists(fn) for fn in outputs)
+
+    def record(self, name: str, inputs: dict, outputs):
+        """Stores the inputs and outputs of a coil that was built"""
+        self.entries[name] = dict(
+            hash=inputs_hash(inputs, self.sources),
+            sources=self.sources,
+            inputs=inputs,
+            outputs=[os.path.basename(fn) for fn in outputs],
+        )
+
+    def save(self):
+        """Writes the manifest, through a temporary file so that a crash never leaves it truncated"""
+        tmp = f"{self.fn}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True, default=float)
+        os.replace(tmp, self.fn)
+
+
+def build_stale(names, inputs, outputs, build, out_dir: str = ".", force: bool = False, sources=()):
+    """Rebuilds the coils whose inputs changed since the last build and updates the manifest
+
+    Parameters
+    ----------
+    names : list of str
+        The names of the coils
+    inputs : callable
+        Returns the inputs of a coil from its name, a dict that can be written as json
+    outputs : callable
+        Returns the paths of the files of a coil from its name
+    build : callable
+        Builds a list of coils given by name
+    out_dir : str
+        The directory of the files and of the manifest
+    force : bool
+        Rebuild every coil even if it is up to date
+    sources : list of str
+        The source files that generate the coils, every coil is rebuilt when one of them changes
+
+    Returns
+    -------
+        The names of the coils that were rebuilt
+    """
+    manifest = Manifest(out_dir, sources)
+    stale = [name for name in names if force or manifest.stale(name, inputs(name), outputs(name))]
+    if stale:
+        build(stale)
+        for name in stale:
+            manifest.record(name, inputs(name), outputs(name))
+        manifest.save()
+
+    return stale
@@ -0,0 +1,83 @@
+"""
+Script to create every coil of the ModeladoL* family in a single process and save them in the tcd format.
+The parameters of each variant are the ones hard-coded in its ModeladoL* script and the coils
+are built in parallel across the cores, so simnibs is only imported once for the whole family.
+
+    Run with:
+
+    simnibs_python ModeladoLote.py                    # Every coil of the family
+    simnibs_python ModeladoLote.py ModeladoL2_0505    # Only the coils given by name
+    simnibs_python ModeladoLote.py --force            # Also the coils that are up to date
+
+Only the coils whose parameters changed since the last run are built again, see Manifiesto. The
+building and the files are shared with SistEstLote, see Lote.
+"""
+
+from Geometria import adaptive_segment_count, figure_of_wire_path
+from Lote import CoilFamily
+from Parametros import (
+    COILS,
+    didt,
+    element_distance,
+    limits,
+    resolution,
+    segment_count,
+    segment_count2,
+    winding_casing_distance,
+)
+
+
+def tcd_name(name: str):
+    """Returns the name of the tcd file written by the script of a coil, e.g.
+    ModeladoL2_0505 -> ModeladoL20505.tcd"""
+    return name.replace("_", "") + ".tcd"
+
+
+def segment_counts(name: str, tolerance: float = None):
+    """Returns the segment_count and segment_count2 of a coil, the fixed ones if tolerance is None
+    or the ones given by adaptive_segment_count"""
+    if tolerance is None:
+        return segment_count, segment_count2
+    params = COILS[name]
+    return adaptive_segment_count(params["N"], tolerance), adaptive_segment_count(params["N2"], tolerance)
+
+
+def coil_wire_path(name: str, tolerance: float = None):
+    """Generates the windings of a coil of the family
+
+    Parameters
+    ----------
+    name : str
+        The name of the coil, one of the keys of COILS
+    tolerance : float
+        The relative field error used to choose the segments per turn of each helix.
+        The fixed segment_count and segment_count2 are used if None
+
+    Returns
+    -------
+        The windings of the coil, shape (n, 3)
+    """
+    params = COILS[name]
+    count, count2 = segment_counts(name, tolerance)
+
+    return figure_of_wire_path(
+        params["radio"],
+        params["N"],
+        params["h"],
+        params["radio2"],
+        params["N2"],
+        params["h2"],
+        count,
+        count2,
+        element_distance,
+        winding_casing_distance,
+    )
+
+
+# The family of the coils, see CoilFamily for building them and writing their files
+FAMILY = CoilFamily(COILS, "coil", tcd_name, coil_wire_path, segment_counts)
+build_coil, build_all, build = FAMILY.build_coil, FAMILY.build_all, FAMILY.build
+
+
+if __name__ == "__main__":
+    FAMILY.main("Writes the tcd files of the ModeladoL* coils")
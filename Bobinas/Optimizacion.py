@@ -0,0 +1,310 @@
+"""
+Gradient-based optimization of the helices of a coil of the ModeladoL* family.
+The derivatives of the induced field at the target points with respect to the radius, turns and
+height of the helices are computed analytically (see vector_potential_derivatives), so SLSQP
+converges in 10 to 20 field evaluations in the examples below instead of enumerating variants in
+copies of the scripts. The segments are fixed for a run, enough for the most turns the constraints
+allow, see adaptive_segment_count, so that the objective is a smooth function of the parameters.
+The windings have to fit in a casing of a given radius and height, keep the distance between
+turns above the wire diameter and, optionally, stay below a wire length. The optimization starts
+from the base coil moved strictly inside those constraints, e.g. the cores of the family are wound
+tighter than the wire and lose turns when N2 is free.
+
+    Run with:
+
+    python Optimizacion.py --base ModeladoL2_0505 --depth 20
+    python Optimizacion.py --objective focality --free radio N h N2 --max-length 8000
+"""
+
+import argparse
+
+import numpy as np
+from scipy.optimize import minimize
+
+from Campo import vector_potential, vector_potential_derivatives, wire_segments
+from Geometria import adaptive_segment_count, figure_of_wire_path, figure_of_wire_path_derivatives
+from Parametros import COILS, didt, element_distance, winding_casing_distance
+
+# The parameters of the helices, in the order of figure_of_wire_path_derivatives
+PARAMETERS = ("radio", "N", "h", "radio2", "N2", "h2")
+
+
+class CoilOptimizer:
+    """Optimizer of the helices of a coil
+
+    Parameters
+    ----------
+    base : dict
+        The parameters of the starting coil, as the entries of COILS
+    targets : np.ndarray
+        The points (mm) where the field is maximized, shape (m, 3)
+    surround : np.ndarray
+        The points (mm) where the field is minimized relative to the targets for the focality,
+        shape (s, 3). Only the field at the targets is used if None
+    free : list of str
+        The parameters that are optimized, the rest keep the value of base
+    max_radius : float
+        The radius (mm) of the casing, the largest radius of the helices
+    max_height : float
+        The height (mm) of the casing, the largest height of the helices
+    max_length : float
+        The largest length (mm) of the wire, unbounded if None
+    segment_count : int
+        The amount of segments of the coil, the one of adaptive_segment_count for the most turns
+        allowed if None: max_height / wire_diam when N is free, N otherwise
+    segment_count2 : int
+        The amount of segments of the core, the same for N2 if None
+    tolerance : float
+        The relative field error of adaptive_segment_count
+    margin : float
+        How far inside the linear constraints the optimization starts, relative to the size of
+        their terms, see start
+    """
+
+    def __init__(
+        self,
+        base: dict,
+        targets,
+        surround=None,
+        free=("radio", "N", "h"),
+        max_radius: float = None,
+        max_height: float = None,
+        max_length: float = None,
+        segment_count: int = None,
+        segment_count2: int = None,
+        tolerance: float = 1e-3,
+        margin: float = 0.05,
+    ):
+        unknown = [name for name in free if name not in PARAMETERS]
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+        self.base = base
+        self.targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        self.surround = None if surround is None else np.atleast_2d(np.asarray(surround, dtype=float))
+        self.free = [PARAMETERS.index(name) for name in free]
+        self.max_radius = max(base["radio"], base["radio2"]) if max_radius is None else max_radius
+        self.max_height = max(base["h"], base["h2"]) if max_height is None else max_height
+        self.max_length = max_length
+        self.tolerance = tolerance
+        self.margin = margin
+
+        # The segments do not change during a run, a jump in the segments is a jump in the objective
+        def most_turns(name):
+            return self.max_height / base["wire_diam"] if name in free else base[name]
+
+        self.segment_count = adaptive_segment_count(most_turns("N"), tolerance) if segment_count is None else segment_count
+        self.segment_count2 = (
+            adaptive_segment_count(most_turns("N2"), tolerance) if segment_count2 is None else segment_count2
+        )
+        self.x0 = np.array([base[PARAMETERS[i]] for i in self.free], dtype=float)
+        self.evaluations = 0
+        self._cache = None
+
+    def params(self, x):
+        """The values of every parameter for the scaled free parameters x"""
+        values = np.array([self.base[name] for name in PARAMETERS], dtype=float)
+        values[self.free] = x * self.x0
+        return values
+
+    def wire_path(self, x):
+        """The windings for the scaled free parameters x, shape (n, 3)"""
+        return figure_of_wire_path(
+            *self.params(x),
+            self.segment_count,
+            self.segment_count2,
+            element_distance,
+            winding_casing_distance,
+        )
+
+    def _evaluate(self, x):
+        """Objective, wire length and their gradients with respect to x, cached for the last x"""
+        if self._cache is not None and np.array_equal(self._cache[0], x):
+            return self._cache[1]
+        self.evaluations += 1
+        wire_path = self.wire_path(x)
+        tangents = figure_of_wire_path_derivatives(*self.params(x), self.segment_count, self.segment_count2)
+        # The optimizer works on the free parameters divided by their starting value
+        tangents = tangents[self.free] * self.x0[:, None, None]
+
+        def log_power(points):
+            # log of the mean |A|^2 at the points and its gradient
+            a = vector_potential(wire_path, points)
+            da = vector_potential_derivatives(wire_path, tangents, points)
+            power = np.sum(a * a)
+            return np.log(power / len(points)), 2 * np.einsum("mi,kmi->k", a, da) / power
+
+        objective, gradient = log_power(self.targets)
+        objective, gradient = -objective, -gradient
+        if self.surround is not None:
+            surround, surround_gradient = log_power(self.surround)
+            objective += surround
+            gradient += surround_gradient
+
+        start, end = wire_segments(wire_path)
+        dl = end - start
+        length = np.linalg.norm(dl, axis=1)
+        unit = dl / length[:, None]
+        length_gradient = np.einsum("ni,kni->k", unit, np.diff(tangents, axis=1))
+
+        self._cache = (x.copy(), (objective, gradient, length.sum(), length_gradient))
+        return self._cache[1]
+
+    def objective(self, x):
+        """Minus log of the mean |A|^2 at the targets, plus log of the mean |A|^2 at the
+        surround for the focality, and its gradient"""
+        objective, gradient, _, _ = self._evaluate(x)
+        return objective, gradient
+
+    def _linear(self, name: str):
+        """A parameter as a linear function of x, the constant and the coefficients"""
+        i = PARAMETERS.index(name)
+        coefficients = np.zeros(len(self.free))
+        if i in self.free:
+            coefficients[self.free.index(i)] = self.x0[self.free.index(i)]
+            return 0.0, coefficients
+        return float(self.base[name]), coefficients
+
+    def _linear_constraints(self):
+        """The linear constraints, as (name, constant, coefficients) with constant + coefficients @ x >= 0
+        at the feasible points. The ones that do not depend on the free parameters are left out."""
+        p = {name: self._linear(name) for name in PARAMETERS}
+        wire_diam = self.base["wire_diam"]
+
+        def combine(terms):
+            # Sum of (weight, parameter) terms plus a constant, as a linear function of x
+            constant, coefficients = 0.0, np.zeros(len(self.free))
+            for weight, term in terms:
+                c, v = (term, 0) if np.isscalar(term) else term
+                constant += weight * c
+                coefficients = coefficients + weight * v
+            return constant, coefficients
+
+        linear = [
+            ("radio <= max_radius", combine([(1, self.max_radius), (-1, p["radio"])])),
+            ("radio2 <= max_radius", combine([(1, self.max_radius), (-1, p["radio2"])])),
+            ("h <= max_height", combine([(1, self.max_height), (-1, p["h"])])),
+            ("h2 <= max_height", combine([(1, self.max_height), (-1, p["h2"])])),
+            # The pitch h / N keeps the turns at least a wire diameter apart
+            ("h >= wire_diam * N", combine([(1, p["h"]), (-wire_diam, p["N"])])),
+            ("h2 >= wire_diam * N2", combine([(1, p["h2"]), (-wire_diam, p["N2"])])),
+        ]
+        return [(name, c, v) for name, (c, v) in linear if np.any(v)]
+
+    def _constraints(self):
+        """Constraints of SLSQP, every function is >= 0 at the feasible points"""
+        constraints = [
+            dict(type="ineq", fun=lambda x, c=c, v=v: c + v @ x, jac=lambda x, v=v: v)
+            for _, c, v in self._linear_constraints()
+        ]
+        if self.max_length is not None:
+            constraints.append(
+                dict(
+                    type="ineq",
+                    fun=lambda x: self.max_length - self._evaluate(x)[2],
+                    jac=lambda x: -self._evaluate(x)[3],
+                )
+            )
+
+        return constraints
+
+    def start(self):
+        """The scaled free parameters closest to the base coil that meet the linear constraints
+        with the margin, e.g. the base with fewer turns of the core when its pitch is below the
+        wire diameter. A start on the boundary of the constraints leaves SLSQP no room to move,
+        so the margin is only dropped when no start meets it. Raises a ValueError if there are none."""
+        linear = self._linear_constraints()
+        for margin in (self.margin, 0.0):
+            # constant + coefficients @ x >= margin * (|constant| + |coefficients| @ x), still linear in x > 0
+            shifted = [(name, c - margin * abs(c), v - margin * np.abs(v)) for name, c, v in linear]
+            x = np.ones(len(self.free))
+            if all(c + v @ x >= 0 for _, c, v in shifted):
+                return x
+            result = minimize(
+                lambda x: (0.5 * np.sum((x - 1) ** 2), x - 1),
+                x,
+                jac=True,
+                method="SLSQP",
+                bounds=[(1e-3, None)] * len(self.free),
+                constraints=[
+                    dict(type="ineq", fun=lambda x, c=c, v=v: c + v @ x, jac=lambda x, v=v: v) for _, c, v in shifted
+                ],
+            )
+            violated = [name for name, c, v in shifted if c + v @ result.x < -1e-9 * max(1.0, abs(c))]
+            if not violated:
+                return result.x
+        raise ValueError(f"No start meets the constraints {', '.join(violated)} with the free parameters")
+
+    def optimize(self, maxiter: int = 50, tol: float = 1e-6):
+        """Runs SLSQP from the base coil
+
+        Returns
+        -------
+            The optimized parameters as a dict, with the objective, the wire length (mm), the peak
+            |dA/dt| at the targets (V/m), the amount of field evaluations, the parameters of the
+            start, the base coil moved into the constraints, see start, and the segments of the run
+        """
+        self.evaluations = 0
+        x0 = self.start()
+        result = minimize(
+            self.objective,
+            x0,
+            jac=True,
+            method="SLSQP",
+            # Every parameter stays positive
+            bounds=[(1e-3, None)] * len(self.free),
+            constraints=self._constraints(),
+            options=dict(maxiter=maxiter, ftol=tol),
+        )
+        objective, _, length, _ = self._evaluate(result.x)
+        peak = didt * np.linalg.norm(vector_potential(self.wire_path(result.x), self.targets), axis=1).max()
+
+        return dict(
+            zip(PARAMETERS, self.params(result.x).tolist()),
+            objective=float(objective),
+            wire_length=float(length),
+            peak_dadt=float(peak),
+            evaluations=self.evaluations,
+            start=dict(zip(PARAMETERS, self.params(x0).tolist())),
+            segment_counts=(self.segment_count, self.segment_count2),
+            success=bool(result.success),
+            message=result.message,
+        )
+
+
+def ring(radius: float, z: float, n: int = 16):
+    """Points on a circle of a radius (mm) around the z axis at the height z (mm), shape (n, 3)"""
+    phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return np.stack((radius * np.cos(phi), radius * np.sin(phi), np.full(n, z)), axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimizes the helices of a ModeladoL* coil")
+    parser.add_argument("--base", default="ModeladoL10505", choices=list(COILS), help="Starting coil")
+    parser.add_argument("--objective", default="depth", choices=("depth", "focality"), help="Quantity to maximize")
+    parser.add_argument("--free", nargs="+", default=["radio", "N", "h"], choices=PARAMETERS, help="Parameters to optimize")
+    parser.add_argument("--depth", type=float, default=10.0, help="Distance (mm) of the targets below the casing")
+    parser.add_argument("--target-radius", type=float, default=None, help="Radius (mm) of the ring of targets, the coil radius if not given")
+    parser.add_argument("--max-radius", type=float, default=None, help="Radius (mm) of the casing")
+    parser.add_argument("--max-height", type=float, default=None, help="Height (mm) of the casing")
+    parser.add_argument("--max-length", type=float, default=None, help="Largest length (mm) of the wire")
+    parser.add_argument("--maxiter", type=int, default=50, help="Largest amount of iterations")
+    parser.add_argument(
+        "--tolerance", type=float, default=1e-3, help="Relative field error that sets the segments per turn"
+    )
+    args = parser.parse_args()
+
+    base = COILS[args.base]
+    max_height = max(base["h"], base["h2"]) if args.max_height is None else args.max_height
+    # The windings go down from the casing distance, the targets are below the bottom of the casing
+    z = -(winding_casing_distance + max_height + args.depth)
+    target_radius = base["radio"] if args.target_radius is None else args.target_radius
+    targets = ring(target_radius, z)
+    surround = None
+    if args.objective == "focality":
+        surround = np.concatenate([ring(k * target_radius, z) for k in (2, 3, 4)])
+
+    optimizer = CoilOptimizer(
+        base, targets, surround, args.free, args.max_radius, max_height, args.max_length, tolerance=args.tolerance
+    )
+    for name, value in optimizer.optimize(args.maxiter).items():
+        print(f"{name}: {value}")
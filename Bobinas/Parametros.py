@@ -0,0 +1,100 @@
+"""
+Parameters of the coils of the ModeladoL* family and of the SistEstL* stimulators, and the settings
+shared by the scripts that build them. Plain values only, so the sweep and the optimizer can use
+them without SimNIBS.
+"""
+
+# Parameters of every coil, keyed on the name of its script: turns and height (mm) of the coil,
+# turns and height (mm) of the core, radius of the coil and of the core (mm) and wire diameter (mm)
+COILS = {
+    "ModeladoBobina": dict(N=3.5, h=2.625, N2=68.5, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL10505": dict(N=3.5, h=2.625, N2=68.5, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL1051": dict(N=3.5, h=2.625, N2=70.8, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL10510": dict(N=3.5, h=2.625, N2=62.625, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL10515": dict(N=3.5, h=2.625, N2=56.585, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL1052": dict(N=3.5, h=2.625, N2=68.75, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL10520": dict(N=3.5, h=2.625, N2=56, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL1055": dict(N=3.5, h=2.625, N2=64.51, h2=15, radio=7.5, radio2=40, wire_diam=0.75),
+    "ModeladoL2_0505": dict(N=5.5, h=2.2, N2=50.5, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_1005": dict(N=5.5, h=2.2, N2=46.15, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_105": dict(N=5.5, h=2.2, N2=47.6, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_1505": dict(N=5.5, h=2.2, N2=42.18, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_2005": dict(N=5.5, h=2.2, N2=39.56, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_205": dict(N=5.5, h=2.2, N2=48.5, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL2_505": dict(N=5.5, h=2.2, N2=47, h2=15, radio=4, radio2=40, wire_diam=0.4),
+    "ModeladoL3_0505": dict(N=4.5, h=1.8, N2=20, h2=8, radio=2.9, radio2=10, wire_diam=0.4),
+    "ModeladoL3_1005": dict(N=4.5, h=1.8, N2=33, h2=4, radio=2.9, radio2=5, wire_diam=0.4),
+    "ModeladoL3_105": dict(N=4.5, h=1.8, N2=18.2278, h2=8, radio=2.9, radio2=10, wire_diam=0.4),
+    "ModeladoL3_1505": dict(N=4.5, h=1.8, N2=19.2537, h2=4, radio=2.9, radio2=7, wire_diam=0.4),
+    "ModeladoL3_2005": dict(N=4.5, h=1.8, N2=19.31, h2=4, radio=2.9, radio2=7, wire_diam=0.4),
+    "ModeladoL3_205": dict(N=4.5, h=1.8, N2=18.059, h2=8, radio=2.9, radio2=10, wire_diam=0.4),
+    "ModeladoL3_505": dict(N=4.5, h=1.8, N2=17.553, h2=8, radio=2.9, radio2=10, wire_diam=0.4),
+    "ModeladoL4_0505": dict(N=6.5, h=1.17, N2=15.84, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_1005": dict(N=6.5, h=1.17, N2=13.5, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_105": dict(N=6.5, h=1.17, N2=15.58, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_1505": dict(N=6.5, h=1.17, N2=10.19, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_2005": dict(N=6.5, h=1.17, N2=13, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_205": dict(N=6.5, h=1.17, N2=14.933, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL4_505": dict(N=6.5, h=1.17, N2=12, h2=4, radio=1.25, radio2=7, wire_diam=0.18),
+    "ModeladoL5_0505": dict(N=7.5, h=0.9, N2=8.59, h2=4, radio=1.2, radio2=7, wire_diam=0.12),
+    "ModeladoL5_1005": dict(N=7.5, h=0.9, N2=7.2961, h2=4, radio=1.2, radio2=7, wire_diam=0.12),
+    "ModeladoL5_105": dict(N=7.5, h=0.9, N2=9.368, h2=4, radio=1.2, radio2=7, wire_diam=0.12),
+    "ModeladoL5_1505": dict(N=7.5, h=0.9, N2=6.92, h2=0.5, radio=1.2, radio2=5, wire_diam=0.12),
+    "ModeladoL5_2005": dict(N=7.5, h=0.9, N2=7.25, h2=0.5, radio=1.2, radio2=5, wire_diam=0.12),
+    "ModeladoL5_205": dict(N=7.5, h=0.9, N2=8.29, h2=4, radio=1.2, radio2=7, wire_diam=0.12),
+    "ModeladoL5_505": dict(N=7.5, h=0.9, N2=7.823555, h2=4, radio=1.2, radio2=7, wire_diam=0.12),
+    "ModeladoL6_0505": dict(N=1, h=0.8, N2=0.6935, h2=0.5, radio=0.4, radio2=2, wire_diam=0.07),
+    "ModeladoL6_1005": dict(N=1, h=0.8, N2=2.67, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+    "ModeladoL6_105": dict(N=1, h=0.8, N2=2.64, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+    "ModeladoL6_1505": dict(N=1, h=0.8, N2=2.598, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+    "ModeladoL6_2005": dict(N=1, h=0.8, N2=2.554, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+    "ModeladoL6_205": dict(N=1, h=0.8, N2=2.27486, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+    "ModeladoL6_505": dict(N=1, h=0.8, N2=2.692, h2=0.5, radio=0.4, radio2=1, wire_diam=0.07),
+}
+
+# Set up the parameters shared by every coil
+# Segments of the coil and of the core when no field tolerance is given
+segment_count = 600
+segment_count2 = 600
+element_distance = 0
+winding_casing_distance = 0.5
+
+# The limits of the a field of the coil, used for the transformation into nifti format
+limits = [[-300.0, 300.0], [-200.0, 200.0], [-100.0, 300.0]]
+# The resolution used when sampling to transform into nifti format
+resolution = [2, 2, 2]
+# Maximum dI/dt of the example stimulator (A/s)
+didt = 122.22e6
+
+# Parameters of every stimulator, keyed on the name of its script: radius (mm), turns and height (mm)
+# of the coil and of the core, wire diameter (mm) and the elements in the order of the script, as the
+# centre (mm) of each element and whether its coil is reversed by np.fliplr. The core of SistEstL5 is
+# wound from the top, as the coils, instead of from the bottom. SistEstL5 and SistEstL6 do not run as
+# written, their parameters are the ones their scripts use once the core pitch of SistEstL5 takes N2
+# and h2 and the indentation of SistEstL6 is fixed: the coils of SistEstL6 have the radius outer_diam3
+SISTEST = {
+    "SistEstL1": dict(
+        radio=7.5, N=3.5, h=2.625, radio2=40, N2=68.5, h2=15, wire_diam=0.75,
+        elements=[((0, 11.497), False), ((12.386, 0), True), ((0, -11.497), False), ((-12.386, 0), True)],
+    ),
+    "SistEstL2": dict(
+        radio=4, N=5.5, h=2.2, radio2=40, N2=50.5, h2=15, wire_diam=0.4,
+        elements=[((0, 7.842), False), ((8.223, 0), True), ((0, -7.842), False), ((-8.223, 0), True)],
+    ),
+    "SistEstL3": dict(
+        radio=2.9, N=4.5, h=1.8, radio2=10, N2=20, h2=8, wire_diam=0.4,
+        elements=[((0, 5.259), False), ((5.641, 0), True), ((0, -5.259), False), ((-5.641, 0), True)],
+    ),
+    "SistEstL4": dict(
+        radio=1.25, N=6.5, h=1.17, radio2=7, N2=15.84, h2=4, wire_diam=0.75,
+        elements=[((0, 2.7185), False), ((3.5335, 0), True), ((0, -2.7185), False), ((-3.5335, 0), True)],
+    ),
+    "SistEstL5": dict(
+        radio=4, N=7.5, h=0.9, radio2=40, N2=8.59, h2=4, wire_diam=0.4, core_from_top=True,
+        elements=[((0, 1.451), False), ((1.504, 0), True), ((0, -1.451), False), ((-1.504, 0), True)],
+    ),
+    "SistEstL6": dict(
+        radio=0.4, N=1, h=0.8, radio2=10, N2=0.6935, h2=0.5, wire_diam=0.4,
+        elements=[((0, 1.0035), False), ((0.971, 0), True), ((-0.971, 0), False), ((0, -1.0035), True)],
+    ),
+}
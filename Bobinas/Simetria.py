@@ -0,0 +1,191 @@
+"""
+Field of arrays of repeated elements, such as the 4 copies of the same coil in the SistEstL*
+stimulators. The elements can be split into their windings, e.g. the core and the coil, since
+an element can reverse only one of them and so not be a copy of the others as a whole.
+Windings that are a rotated and translated copy of another winding, in the same or in the
+reverse order, share the field of that winding: it is sampled once on a local grid that covers
+every copy and the field of each copy is the rotated, interpolated field of the canonical
+winding, negated when the current runs in the reverse order. The points next to the windings,
+where the interpolation is not accurate, and the segments joining the windings are summed
+directly. The cost of sampling an array is about the cost of one winding for every distinct geometry.
+"""
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+from scipy.spatial import cKDTree
+
+from CacheCampo import FieldCache
+from Campo import grid_axes, sample_grid, vector_potential
+
+
+def _kabsch(source, target):
+    """Rotation R that best maps the centred points source onto target, R @ source[i] ~ target[i]"""
+    u, _, vt = np.linalg.svd(source.T @ target)
+    # Proper rotations only, a reflection would mirror the winding direction of the helices
+    d = np.sign(np.linalg.det(vt.T @ u.T))
+    return vt.T @ np.diag((1.0, 1.0, d)) @ u.T
+
+
+def find_repeats(wire_paths, tolerance: float = 1e-6):
+    """Finds the elements that are rigid copies of other elements
+
+    Parameters
+    ----------
+    wire_paths : list of np.ndarray
+        The windings of every element (mm), shape (n, 3) each
+    tolerance : float
+        The largest distance between the points of a copy and of the transformed element,
+        relative to the size of the element
+
+    Returns
+    -------
+        For every element, a tuple (canonical, rotation, centre, sign): the index of the element it
+        is a copy of, the rotation matrix and the centre (mm) of the copy, so that its points are
+        rotation @ (canonical points - canonical centre) + centre, and -1 if they run in the reverse
+        order. The canonical elements are their own copy with the identity rotation.
+    """
+    repeats = []
+    canonicals = []
+    for i, wire_path in enumerate(wire_paths):
+        points = np.asarray(wire_path, dtype=float)
+        centre = points.mean(axis=0)
+        local = points - centre
+        scale = max(np.abs(local).max(), 1e-12)
+        match = None
+        for c in canonicals:
+            source = np.asarray(wire_paths[c], dtype=float)
+            if source.shape != points.shape:
+                continue
+            source = source - source.mean(axis=0)
+            for sign, target in ((1, local), (-1, local[::-1])):
+                rotation = _kabsch(source, target)
+                if np.abs(source @ rotation.T - target).max() <= tolerance * scale:
+                    match = (c, rotation, centre, sign)
+                    break
+            if match is not None:
+                break
+        if match is None:
+            canonicals.append(i)
+            match = (i, np.eye(3), centre, 1)
+        repeats.append(match)
+
+    return repeats
+
+
+def _split_windings(wire_path, windings):
+    """Splits the windings of an element at the given points
+
+    Returns
+    -------
+    pieces : list of np.ndarray
+        The points of every winding (mm)
+    joins : list of np.ndarray
+        The segments joining consecutive windings (mm), shape (2, 3) each
+    """
+    bounds = [0] + list(windings) + [len(wire_path)]
+    pieces = [wire_path[i0:i1] for i0, i1 in zip(bounds[:-1], bounds[1:]) if i1 - i0 > 1]
+    joins = [wire_path[i - 1:i + 1] for i in windings if 0 < i < len(wire_path)]
+
+    return pieces, joins
+
+
+def channel_grids(
+    wire_paths,
+    limits,
+    resolution,
+    didt: float = 1.0,
+    tolerance: float = 1e-6,
+    oversample: int = 1,
+    near: float = 4.0,
+    cache: FieldCache = None,
+    windings=(),
+    **options,
+):
+    """Samples dA/dt of every element of an array on a grid, sampling each distinct winding once
+
+    Parameters
+    ----------
+    wire_paths : list of np.ndarray
+        The windings of every element (mm), shape (n, 3) each
+    limits : list
+        The limits of the grid (mm)
+    resolution : list
+        The spacing of the grid (mm)
+    didt : float
+        The rate of change of the current (A/s)
+    tolerance : float
+        The tolerance used to detect the copies, see find_repeats
+    oversample : int
+        The local grid of the canonical windings is resolution / oversample
+    near : float
+        The points closer to a winding than near times the spacing of the local grid are computed
+        directly instead of interpolated
+    cache : FieldCache
+        The cache used for the local grids, they are sampled without a cache if None
+    windings : list of int
+        The first point of every winding of an element after the first one, e.g. the amount of
+        points of the core when the coil follows it. The whole element is one winding if empty
+    options :
+        Passed to sample_grid
+
+    Returns
+    -------
+        dA/dt (V/m) of every element, shape (M, nx, ny, nz, 3), float32
+    """
+    axes = grid_axes(limits, resolution)
+    points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+    local_resolution = np.asarray(resolution, dtype=float) / oversample
+
+    grids = np.zeros((len(wire_paths),) + points.shape, dtype=np.float32)
+    # Every winding of every element, with the element it belongs to
+    owners, pieces = [], []
+    for i, wire_path in enumerate(wire_paths):
+        element_pieces, joins = _split_windings(np.asarray(wire_path, dtype=float), windings)
+        owners += [i] * len(element_pieces)
+        pieces += element_pieces
+        for join in joins:
+            grids[i] += didt * vector_potential(join, points.reshape(-1, 3), **options).reshape(points.shape)
+    repeats = find_repeats(pieces, tolerance)
+
+    for c in sorted({canonical for canonical, _, _, _ in repeats}):
+        copies = [(i, rotation, centre, sign) for i, (canonical, rotation, centre, sign) in enumerate(repeats) if canonical == c]
+        canonical_points = pieces[c]
+        canonical_centre = canonical_points.mean(axis=0)
+        tree = cKDTree(canonical_points)
+        segment = np.linalg.norm(np.diff(canonical_points, axis=0), axis=1).max(initial=0)
+        near_distance = near * local_resolution.max() + segment / 2
+        # Points of the grid seen from the canonical winding, for every copy
+        local_points = [(points - centre) @ rotation + canonical_centre for _, rotation, centre, _ in copies]
+
+        # Local grid covering all of them, aligned with the local resolution
+        lower = np.min([p.reshape(-1, 3).min(axis=0) for p in local_points], axis=0)
+        upper = np.max([p.reshape(-1, 3).max(axis=0) for p in local_points], axis=0)
+        lower = np.floor(lower / local_resolution) * local_resolution
+        upper = np.ceil(upper / local_resolution) * local_resolution
+        local_limits = np.stack((lower, upper), axis=1).tolist()
+        if cache is None:
+            local_grid = sample_grid(canonical_points, local_limits, local_resolution, didt, **options)
+        else:
+            local_grid = cache.sample(canonical_points, didt, local_limits, local_resolution, **options)
+
+        for (i, rotation, _, sign), p in zip(copies, local_points):
+            coordinates = np.moveaxis((p - lower) / local_resolution, -1, 0)
+            value = np.stack(
+                [map_coordinates(local_grid[..., k], coordinates, order=1, mode="nearest") for k in range(3)],
+                axis=-1,
+            )
+            # A is a vector, it rotates with the winding
+            value = sign * value @ rotation.T
+
+            distance, _ = tree.query(p.reshape(-1, 3), distance_upper_bound=near_distance)
+            close = np.isfinite(distance).reshape(p.shape[:-1])
+            if close.any():
+                value[close] = didt * vector_potential(pieces[i], points[close], **options)
+            grids[owners[i]] += value
+
+    return grids
+
+
+def sample_grid_symmetric(wire_paths, limits, resolution, didt: float = 1.0, **options):
+    """Samples dA/dt of a whole array on a grid, the sum of channel_grids, see sample_grid"""
+    return channel_grids(wire_paths, limits, resolution, didt, **options).sum(axis=0)
@@ -0,0 +1,102 @@
+"""
+Script to create the 4 coil stimulators of the SistEstL* scripts and save them in the tcd format.
+Every element of an array is a coil with its core, with the radii, turns, heights, positions and
+winding directions hard-coded in the SistEstL* script of the stimulator. All the elements are
+generated at once by array_wire_paths instead of calling one copy of spiral per winding, and every
+element is written as its own channel instead of being joined into a single wire, see Canales.
+
+    Run with:
+
+    simnibs_python SistEstLote.py                 # Every stimulator
+    simnibs_python SistEstLote.py SistEstL3       # Only the stimulators given by name
+    simnibs_python SistEstLote.py --force         # Also the stimulators that are up to date
+
+Only the stimulators whose parameters changed since the last run are built again, see Manifiesto.
+The building and the files are shared with ModeladoLote, see Lote.
+"""
+
+import numpy as np
+
+from Geometria import adaptive_segment_count, array_wire_paths, spiral, spiral2
+from Lote import CoilFamily
+from Parametros import SISTEST, didt, limits, resolution, segment_count, segment_count2, winding_casing_distance
+
+
+def tcd_name(name: str):
+    """Returns the name of the tcd file of a stimulator, e.g. SistEstL1 -> SisEstL1.tcd"""
+    return name.replace("SistEst", "SisEst") + ".tcd"
+
+
+def sistest_centres(name: str):
+    """Returns the centres of the elements of a stimulator in the order of its script, shape (4, 3)"""
+    return np.array([(x, y, 0) for (x, y), _ in SISTEST[name]["elements"]], dtype=float)
+
+
+def sistest_directions(name: str):
+    """Returns the winding direction of every element of a stimulator, -1 where the script reverses
+    its coil, shape (4,)"""
+    return np.array([-1 if flip else 1 for _, flip in SISTEST[name]["elements"]])
+
+
+def sistest_segment_counts(name: str, tolerance: float = None):
+    """Returns the segments of the coil and of the core of the elements of a stimulator, the fixed
+    ones if tolerance is None or the ones given by adaptive_segment_count"""
+    if tolerance is None:
+        return segment_count, segment_count2
+    params = SISTEST[name]
+    return adaptive_segment_count(params["N"], tolerance), adaptive_segment_count(params["N2"], tolerance)
+
+
+def sistest_element_path(name: str, tolerance: float = None):
+    """Generates the windings of one element of a stimulator centred at the origin: the core,
+    reversed as in the scripts, followed by the coil
+
+    Returns
+    -------
+        The windings of the element, shape (count2 + count, 3), and the amount of points of the core
+    """
+    params = SISTEST[name]
+    count, count2 = sistest_segment_counts(name, tolerance)
+    position = np.array((0, 0, -winding_casing_distance))[:, None]
+
+    core = (spiral if params.get("core_from_top", False) else spiral2)(
+        params["radio2"], params["N2"], params["h2"], count2
+    )
+    coil = spiral(params["radio"], params["N"], params["h"], count)
+
+    return np.concatenate((np.fliplr(core + position), coil + position), axis=1).T, count2
+
+
+def sistest_wire_paths(name: str, tolerance: float = None):
+    """Generates the windings of every element of a stimulator
+
+    Parameters
+    ----------
+    name : str
+        The name of the stimulator, one of the keys of SISTEST
+    tolerance : float
+        The relative field error used to choose the segments per turn, see sistest_segment_counts
+
+    Returns
+    -------
+        The windings of the elements, shape (4, P, 3)
+    """
+    element_path, core_count = sistest_element_path(name, tolerance)
+    return array_wire_paths(
+        element_path, sistest_centres(name), directions=sistest_directions(name), reverse_from=core_count
+    )
+
+
+def sistest_windings(name: str, tolerance: float = None):
+    """Returns where the coil starts in the windings of an element of a stimulator, after the
+    points of the core, for channel_grids"""
+    return [sistest_segment_counts(name, tolerance)[1]]
+
+
+# The family of the stimulators, see CoilFamily for building them and writing their files
+FAMILY = CoilFamily(SISTEST, "stimulator", tcd_name, sistest_wire_paths, sistest_segment_counts)
+build_sistest, build_all, build = FAMILY.build_coil, FAMILY.build_all, FAMILY.build
+
+
+if __name__ == "__main__":
+    FAMILY.main("Writes the tcd files of the SistEstL* stimulators")
@@ -2,11 +2,21 @@
     Run with:
 
     simnibs_python TMS.py
+    simnibs_python TMS.py --roi-centre -39 -6 66 --roi-radius 10   # Only the fields of a region, see TMSRegion
     Copyright (C) 2018 Guilherme B Saturnino
 """
+import argparse
 import os
 from simnibs import sim_struct, run_simnibs
 
+from TMSLote import output_name, subject_id
+from TMSPersistente import PersistentSolver
+from TMSRegion import add_region_arguments, region_from_arguments
+
+parser = argparse.ArgumentParser(description="Runs a SimNIBS TMS simulation")
+add_region_arguments(parser)
+region = region_from_arguments(parser.parse_args())
+
 ###General information
 S = sim_struct.SESSION()
 S.subpath = 'm2m_ernie'  # m2m-folder of the subject
@@ -24,6 +34,11 @@ pos.pos_ydir = [1.0,0.0,1.0]  #Orientation of the coil
 pos.distance = 4  #Distance from coil surface to head surface (mm)
 pos.didt = 6.283185307 #Define the value of didt
 
-# Run Simulation
-run_simnibs(S)
+# Run Simulation, with a region of interest only its fields are written
+if region is None:
+    run_simnibs(S)
+else:
+    solver = PersistentSolver(subpath=S.subpath, fields=S.fields)
+    fn_out = output_name(S.pathfem, subject_id(S.subpath), 0, 0, tms.fnamecoil)
+    solver.run(tms.fnamecoil, pos.centre, pos.pos_ydir, pos.distance, pos.didt, fn_out, region)
 
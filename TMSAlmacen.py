@@ -0,0 +1,281 @@
+""" Compact store of the E-field of TMS simulations, for queries in a region
+    The .msh outputs of run_simnibs are large and slow to read when only the field in a region is
+    needed. The field of every tetrahedron is written to an HDF5 file instead, compressed in chunks of
+    elements that are close to each other: the elements are sorted along a Z-order curve of their
+    centres. A small index per head model holds the order of the elements, their centres and the box
+    of every chunk, so a query of a region reads only the chunks whose box it touches.
+
+    Run with:
+
+    simnibs_python TMSAlmacen.py index tms_simu/m2m_ernie/ernie_TMS_1-0001_ModeladoL1052_scalar.msh ernie_index.h5
+    simnibs_python TMSAlmacen.py export ernie_index.h5 tms_simu/m2m_ernie/*.msh
+    simnibs_python TMSAlmacen.py query ernie_index.h5 tms_simu/m2m_ernie/*.h5 --centre -39 -6 66 --radius 10
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sys
+
+import h5py
+import numpy as np
+from scipy.spatial import cKDTree
+from simnibs import mesh_io
+
+# Fields of the outputs that are stored, if present
+FIELDS = ("E", "magnE")
+
+# Bits of every coordinate in the Z-order curve
+morton_bits = 21
+
+
+def _spread_bits(q):
+    """Spreads the bits of q so that there are two zero bits between every two of them"""
+    q = q.astype(np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        q = (q | (q << np.uint64(shift))) & np.uint64(mask)
+    return q
+
+
+def morton_order(points):
+    """Order of the points along a Z-order curve, so that consecutive points are close in space"""
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    q = (points - lower) / np.maximum(upper - lower, 1e-12) * (2**morton_bits - 1)
+    codes = _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1)) | (_spread_bits(q[:, 2]) << np.uint64(2))
+    return np.argsort(codes, kind="stable")
+
+
+def _read_mesh(mesh):
+    """The mesh, read from a file if it is a file name"""
+    return mesh_io.read_msh(mesh) if isinstance(mesh, str) else mesh
+
+
+def build_index(mesh, fn: str, chunk_size: int = 4096):
+    """Writes the index of the tetrahedra of a head model
+
+    Parameters
+    ----------
+    mesh : Msh or str
+        The head mesh, or an output of run_simnibs on it
+    fn : str
+        The index file
+    chunk_size : int
+        The amount of elements of every chunk
+
+    Returns
+    -------
+        The key of the index, stored in every field file written with it
+    """
+    mesh = _read_mesh(mesh)
+    tetrahedra = np.flatnonzero(mesh.elm.elm_type == 4)
+    centres = mesh.elements_baricenters().value[tetrahedra]
+    order = morton_order(centres)
+    elements, centres = tetrahedra[order] + 1, centres[order].astype(np.float32)
+
+    n_chunks = -(-len(elements) // chunk_size)
+    lower = np.empty((n_chunks, 3), dtype=np.float32)
+    upper = np.empty((n_chunks, 3), dtype=np.float32)
+    for c in range(n_chunks):
+        block = centres[c * chunk_size:(c + 1) * chunk_size]
+        lower[c], upper[c] = block.min(axis=0), block.max(axis=0)
+    key = hashlib.sha256(elements.tobytes() + centres.tobytes()).hexdigest()
+
+    with h5py.File(fn, "w") as f:
+        f.attrs["key"] = key
+        f.attrs["chunk_size"] = chunk_size
+        f.create_dataset("elements", data=elements, chunks=(chunk_size,), compression="gzip", shuffle=True)
+        f.create_dataset("centres", data=centres, chunks=(chunk_size, 3), compression="gzip", shuffle=True)
+        f.create_dataset("lower", data=lower)
+        f.create_dataset("upper", data=upper)
+
+    return key
+
+
+class FieldIndex:
+    """Index of a head model, see build_index
+
+    Parameters
+    ----------
+    fn : str
+        The index file
+    """
+
+    def __init__(self, fn: str):
+        self.fn = fn
+        with h5py.File(fn, "r") as f:
+            self.key = f.attrs["key"]
+            self.chunk_size = int(f.attrs["chunk_size"])
+            self.lower = f["lower"][:]
+            self.upper = f["upper"][:]
+            self.size = len(f["elements"])
+
+    def chunks_in_box(self, lower, upper):
+        """The chunks whose box intersects the box lower-upper (mm)"""
+        return np.flatnonzero(np.all((self.upper >= lower) & (self.lower <= upper), axis=1))
+
+    def chunks_in_sphere(self, centre, radius: float):
+        """The chunks whose box is within radius (mm) of the centre"""
+        closest = np.clip(centre, self.lower, self.upper)
+        return np.flatnonzero(np.linalg.norm(closest - centre, axis=1) <= radius)
+
+    def ranges(self, chunks):
+        """The rows of the chunks, merged into contiguous (start, stop) ranges"""
+        chunks = np.asarray(chunks)
+        breaks = np.flatnonzero(np.diff(chunks) != 1) + 1
+        return [
+            (int(run[0]) * self.chunk_size, min(int(run[-1] + 1) * self.chunk_size, self.size))
+            for run in np.split(chunks, breaks)
+            if len(run)
+        ]
+
+    def select_sphere(self, centre, radius: float):
+        """The elements with the centre within radius (mm) of centre, reading only the chunks
+        that can hold them
+
+        Returns
+        -------
+        rows : list of (start, stop, mask)
+            The rows of the stores to read and the elements of them in the sphere
+        elements : np.ndarray
+            The numbers of the elements in the mesh, 1-based as in SimNIBS
+        centres : np.ndarray
+            The centres of the elements (mm)
+        """
+        centre = np.asarray(centre, dtype=float)
+        rows, elements, centres = [], [], []
+        with h5py.File(self.fn, "r") as f:
+            for start, stop in self.ranges(self.chunks_in_sphere(centre, radius)):
+                c = f["centres"][start:stop]
+                mask = np.linalg.norm(c - centre, axis=1) <= radius
+                rows.append((start, stop, mask))
+                elements.append(f["elements"][start:stop][mask])
+                centres.append(c[mask])
+
+        if not rows:
+            return [], np.zeros(0, dtype=int), np.zeros((0, 3), dtype=np.float32)
+        return rows, np.concatenate(elements), np.concatenate(centres)
+
+
+def export_fields(index: FieldIndex, mesh, fn: str, compression: str = "gzip", tolerance: float = 1e-3):
+    """Writes the fields of an output of run_simnibs to a field file in the order of the index.
+    An output cropped to a region, see TMSRegion, has other element numbers than the head model:
+    its tetrahedra are matched to the ones of the index by their centres and the elements of the
+    index outside the region are stored as NaN.
+
+    Parameters
+    ----------
+    index : FieldIndex
+        The index of the head model
+    mesh : Msh or str
+        The output of run_simnibs
+    fn : str
+        The field file
+    compression : str
+        The compression of the chunks, see h5py
+    tolerance : float
+        The largest distance (mm) between the centres of matched tetrahedra
+    """
+    mesh = _read_mesh(mesh)
+    with h5py.File(index.fn, "r") as f:
+        elements = f["elements"][:]
+        centres = f["centres"][:]
+    fields = [name for name in FIELDS if name in mesh.field]
+    if not fields:
+        raise ValueError(f"The mesh has none of the fields {FIELDS}")
+
+    tetrahedra = np.flatnonzero(mesh.elm.elm_type == 4)
+    baricenters = mesh.elements_baricenters().value
+    mesh_centres = baricenters[tetrahedra]
+    if (
+        len(tetrahedra) == len(elements)
+        and elements.max() <= len(baricenters)
+        and np.all(np.abs(baricenters[elements - 1] - centres) <= tolerance)
+    ):
+        # The whole head model, with the numbers of the index
+        rows, present = elements - 1, np.ones(len(elements), dtype=bool)
+    else:
+        distance, match = cKDTree(mesh_centres).query(centres, distance_upper_bound=tolerance)
+        present = np.isfinite(distance)
+        if np.count_nonzero(present) != len(tetrahedra):
+            raise ValueError(
+                f"{len(tetrahedra) - np.count_nonzero(present)} tetrahedra of the mesh are not in the head model of the index"
+            )
+        rows = tetrahedra[match[present]]
+
+    tmp = f"{fn}.{os.getpid()}.tmp"
+    with h5py.File(tmp, "w") as f:
+        f.attrs["key"] = index.key
+        for name in fields:
+            field = np.asarray(mesh.field[name].value, dtype=np.float32)
+            value = np.full((len(elements),) + field.shape[1:], np.nan, dtype=np.float32)
+            value[present] = field[rows]
+            chunks = (index.chunk_size,) + value.shape[1:]
+            f.create_dataset(name, data=value, chunks=chunks, compression=compression, shuffle=True)
+    os.replace(tmp, fn)
+
+
+def read_rows(fn: str, rows, field: str = "magnE", key: str = None):
+    """Reads the values of a field file at the rows of a selection, see FieldIndex.select_sphere.
+    Only the chunks of those rows are read and decompressed."""
+    with h5py.File(fn, "r") as f:
+        if key is not None and f.attrs["key"] != key:
+            raise ValueError(f"{fn} was not written with this index")
+        dataset = f[field]
+        if not rows:
+            return np.zeros((0,) + dataset.shape[1:], dtype=dataset.dtype)
+        return np.concatenate([dataset[start:stop][mask] for start, stop, mask in rows])
+
+
+def roi_values(index: FieldIndex, fns, centre, radius: float, field: str = "magnE"):
+    """Values of a field in a sphere for many field files, the sphere is selected once
+
+    Returns
+    -------
+    elements : np.ndarray
+        The numbers of the elements in the sphere
+    values : list of np.ndarray
+        The values of every file at them, NaN where a cropped output has none
+    """
+    rows, elements, _ = index.select_sphere(centre, radius)
+    return elements, [read_rows(fn, rows, field, index.key) for fn in fns]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact store of the E-field of TMS simulations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("index", help="Writes the index of a head model")
+    p.add_argument("mesh", help="The head mesh, or an output of run_simnibs")
+    p.add_argument("index", help="The index file")
+    p.add_argument("--chunk-size", type=int, default=4096, help="Elements of every chunk")
+    p = commands.add_parser("export", help="Writes the fields of outputs of run_simnibs next to them, as .h5")
+    p.add_argument("index", help="The index file")
+    p.add_argument("meshes", nargs="+", help="Outputs of run_simnibs")
+    p = commands.add_parser("query", help="Writes the mean, 99th percentile and max of a field in a sphere")
+    p.add_argument("index", help="The index file")
+    p.add_argument("stores", nargs="+", help="Field files")
+    p.add_argument("--centre", type=float, nargs=3, required=True, help="The centre of the sphere (mm)")
+    p.add_argument("--radius", type=float, required=True, help="The radius of the sphere (mm)")
+    p.add_argument("--field", default="magnE", help="The field")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        build_index(args.mesh, args.index, args.chunk_size)
+    elif args.command == "export":
+        index = FieldIndex(args.index)
+        for mesh in args.meshes:
+            fn = os.path.splitext(mesh)[0] + ".h5"
+            export_fields(index, mesh, fn)
+            print(fn)
+    else:
+        _, values = roi_values(FieldIndex(args.index), args.stores, args.centre, args.radius, args.field)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("store", "mean", "p99", "max"))
+        for fn, value in zip(args.stores, values):
+            value = np.linalg.norm(value, axis=1) if value.ndim > 1 else value
+            # Elements outside the region of a cropped output
+            value = value[~np.isnan(value)]
+            if len(value):
+                writer.writerow((fn, value.mean(), np.percentile(value, 99), value.max()))
+            else:
+                writer.writerow((fn, np.nan, np.nan, np.nan))
@@ -0,0 +1,406 @@
+""" Batch of SimNIBS TMS simulations, many coils at many positions
+    Reads a table with a row per simulation and runs the simulations of every subject, the subjects
+    in parallel. The head model of a subject is loaded and its FEM system factorized once for all of
+    its coils and positions, see TMSPersistente. With --session they run instead as one SESSION of
+    SimNIBS per subject.
+
+    Every simulation (a position of a coil) that finishes leaves a completion record next to its
+    output, so a batch that dies is resumed by running it again: the simulations whose record
+    matches their row and whose output has the size and modification time of the record are
+    skipped, --verify also compares the checksum. The persistent solver records every output as
+    soon as it is written. A SESSION only returns when all of its simulations finish, so its outputs
+    are recorded then and a crash loses the simulations of the whole SESSION.
+
+    With a region of interest, see TMSRegion, the outputs only hold the fields of its elements. A
+    SESSION writes the whole head, cropping it afterwards would only add the reading and writing of
+    every output, so a region is refused with --session.
+
+    The table is a csv file with the columns:
+        subject   m2m-folder of the subject, or a .msh head model such as Mouse_Digimouse.msh
+        coil      the coil model, e.g. legacy_and_other/ModeladoL1052.tcd
+        centre    the position of the coil (mm), "x y z"
+        pos_ydir  the orientation of the coil, "x y z"
+        distance  distance from coil surface to head surface (mm)
+        didt      the rate of change of the current (A/s)
+
+    Run with:
+
+    simnibs_python TMSLote.py table.csv --processes 2
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from simnibs import sim_struct, run_simnibs
+from simnibs.utils.file_finder import SubjectFiles
+
+from TMSPersistente import PersistentSolver
+from TMSRegion import add_region_arguments, region_from_arguments
+
+# Columns of the table
+COLUMNS = ("subject", "coil", "centre", "pos_ydir", "distance", "didt")
+
+# Directory of the completion records, inside the directory of the simulations of a subject
+records_dir = ".done"
+
+
+def read_table(fn: str):
+    """Reads the rows of a table of simulations
+
+    Parameters
+    ----------
+    fn : str
+        The csv file, with the columns of COLUMNS
+
+    Returns
+    -------
+        The rows, a list of dicts with the centre and pos_ydir as lists and the distance and
+        didt as floats
+    """
+    with open(fn, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = set(COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"{fn} is missing the columns {sorted(missing)}")
+        rows = []
+        for row in reader:
+            rows.append(
+                dict(
+                    subject=row["subject"].strip(),
+                    coil=row["coil"].strip(),
+                    centre=[float(x) for x in row["centre"].split()],
+                    pos_ydir=[float(x) for x in row["pos_ydir"].split()],
+                    distance=float(row["distance"]),
+                    didt=float(row["didt"]),
+                )
+            )
+
+    return rows
+
+
+def group_rows(rows):
+    """Groups the rows by subject and, within a subject, by coil, keeping the order of the table
+
+    Returns
+    -------
+        A dict {subject: {coil: [rows]}}
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["subject"], {}).setdefault(row["coil"], []).append(row)
+
+    return groups
+
+
+def build_session(subject: str, coils: dict, pathfem: str, fields: str = "eE"):
+    """Creates the SESSION of a subject with a TMS list per coil
+
+    Parameters
+    ----------
+    subject : str
+        The m2m-folder of the subject, or a .msh head model
+    coils : dict
+        The rows of every coil, see group_rows
+    pathfem : str
+        Directory for the simulations
+    fields : str
+        Fields to calculate
+
+    Returns
+    -------
+        The SESSION
+    """
+    S = sim_struct.SESSION()
+    if subject.endswith(".msh"):
+        S.fnamehead = subject
+    else:
+        S.subpath = subject
+    S.pathfem = pathfem
+    S.fields = fields
+    # Nothing is opened for every simulation of a batch
+    S.open_in_gmsh = False
+
+    for coil, rows in coils.items():
+        tms = S.add_tmslist()
+        tms.fnamecoil = coil
+        for row in rows:
+            pos = tms.add_position()
+            pos.centre = row["centre"]
+            pos.pos_ydir = row["pos_ydir"]
+            pos.distance = row["distance"]
+            pos.didt = row["didt"]
+
+    return S
+
+
+def subject_pathfem(subject: str, out_dir: str):
+    """Directory for the simulations of a subject, named after its m2m-folder or head model"""
+    name = os.path.splitext(os.path.basename(os.path.normpath(subject)))[0]
+    return os.path.join(out_dir, name)
+
+
+def subject_id(subject: str):
+    """The name SimNIBS gives to the outputs of a subject, e.g. ernie for m2m_ernie"""
+    if subject.endswith(".msh"):
+        return SubjectFiles(fnamehead=subject).subid
+    return SubjectFiles(subpath=subject).subid
+
+
+def output_name(pathfem: str, subid: str, i: int, j: int, coil: str):
+    """Output of the position j of the coil i of a subject, as SimNIBS names it from the subid of
+    the subject, see subject_id"""
+    coil_name = os.path.splitext(os.path.basename(coil))[0]
+    return os.path.join(pathfem, f"{subid}_TMS_{i + 1}-{j + 1:04d}_{coil_name}_scalar.msh")
+
+
+def job_inputs(row: dict, fields: str, region=None):
+    """The inputs of a simulation, as stored in its completion record"""
+    inputs = dict(
+        coil=row["coil"], centre=row["centre"], pos_ydir=row["pos_ydir"], distance=row["distance"],
+        didt=row["didt"], fields=fields,
+    )
+    if region is not None:
+        inputs["region"] = region.as_dict()
+
+    return inputs
+
+
+def checksum(fn: str, block: int = 2**20):
+    """crc32 of a file as a hex string, it reads the file in blocks"""
+    crc = 0
+    with open(fn, "rb") as f:
+        while chunk := f.read(block):
+            crc = zlib.crc32(chunk, crc)
+
+    return f"{crc:08x}"
+
+
+def record_name(fn: str):
+    """Completion record of an output"""
+    return os.path.join(os.path.dirname(fn), records_dir, os.path.basename(fn) + ".json")
+
+
+def record_job(fn: str, inputs: dict):
+    """Writes the completion record of an output, through a temporary file so that a crash
+    never leaves it truncated"""
+    record = record_name(fn)
+    os.makedirs(os.path.dirname(record), exist_ok=True)
+    st = os.stat(fn)
+    tmp = f"{record}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(dict(inputs=inputs, size=st.st_size, mtime_ns=st.st_mtime_ns, crc32=checksum(fn)), f, indent=2)
+    os.replace(tmp, record)
+
+
+def job_done(fn: str, inputs: dict, verify: bool = False):
+    """Whether an output is complete: its record matches the inputs and the output has the size
+    and the modification time of the record. With verify the checksum of the record is also
+    compared, which reads the whole output"""
+    try:
+        with open(record_name(fn)) as f:
+            record = json.load(f)
+        st = os.stat(fn)
+        if record["inputs"] != inputs or st.st_size != record["size"] or st.st_mtime_ns != record["mtime_ns"]:
+            return False
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return False
+
+    return not verify or checksum(fn) == record["crc32"]
+
+
+def missing_jobs(
+    coils: dict, pathfem: str, subid: str, fields: str = "eE", force: bool = False, region=None, verify: bool = False
+):
+    """The simulations of a subject without a valid completion record, see job_done. subid names
+    the outputs, see output_name
+
+    Returns
+    -------
+        A list of (i, j, row, fn): the index of the coil, of the position, its row and its output
+    """
+    jobs = []
+    for i, rows in enumerate(coils.values()):
+        for j, row in enumerate(rows):
+            fn = output_name(pathfem, subid, i, j, row["coil"])
+            if force or not job_done(fn, job_inputs(row, fields, region), verify):
+                jobs.append((i, j, row, fn))
+
+    return jobs
+
+
+def run_persistent(jobs, subject: str, fields: str = "eE", region=None):
+    """Runs the simulations of a subject with a single PersistentSolver, the head model is
+    assembled and factorized once for all of the coils. Every output is recorded as it is written.
+
+    Parameters
+    ----------
+    jobs : list
+        The simulations, see missing_jobs
+    subject : str
+        The m2m-folder of the subject, or a .msh head model
+    fields : str
+        Fields to calculate
+    region : Region
+        Only the elements of this region are written, see TMSRegion
+    """
+    if subject.endswith(".msh"):
+        solver = PersistentSolver(fnamehead=subject, fields=fields)
+    else:
+        solver = PersistentSolver(subpath=subject, fields=fields)
+    for _, _, row, fn in jobs:
+        solver.run(row["coil"], row["centre"], row["pos_ydir"], row["distance"], row["didt"], fn, region)
+        record_job(fn, job_inputs(row, fields, region))
+
+
+def run_session(jobs, subject: str, pathfem: str, fields: str = "eE", cpus: int = 1):
+    """Runs the simulations of a subject as one SESSION in a new directory inside pathfem, then
+    moves every output to its name, see output_name, and records it. The rest of the files of
+    SimNIBS stay in that directory.
+
+    Parameters
+    ----------
+    jobs : list
+        The simulations, see missing_jobs
+    subject : str
+        The m2m-folder of the subject, or a .msh head model
+    pathfem : str
+        Directory for the simulations of the subject
+    fields : str
+        Fields to calculate
+    cpus : int
+        The amount of simulations of the SESSION run at once by SimNIBS
+    """
+    os.makedirs(pathfem, exist_ok=True)
+    coils = {}
+    for job in jobs:
+        coils.setdefault(job[2]["coil"], []).append(job)
+    run_dir = tempfile.mkdtemp(prefix="run_", dir=pathfem)
+    rows = {coil: [row for _, _, row, _ in coil_jobs] for coil, coil_jobs in coils.items()}
+    run_simnibs(build_session(subject, rows, run_dir, fields), cpus=cpus)
+
+    # SimNIBS numbers the TMS lists and positions of the session from 1
+    for i, rows in enumerate(coils.values()):
+        for j, (_, _, row, fn) in enumerate(rows):
+            (output,) = glob.glob(os.path.join(run_dir, f"*_TMS_{i + 1}-{j + 1:04d}_*.msh"))
+            os.replace(output, fn)
+            record_job(fn, job_inputs(row, fields))
+
+
+def run_subject(
+    item,
+    out_dir: str,
+    fields: str = "eE",
+    cpus: int = 1,
+    session: bool = False,
+    force: bool = False,
+    region=None,
+    verify: bool = False,
+):
+    """Runs the simulations of a subject that are not complete, item is a (subject, coils) pair
+    of group_rows, and returns the directory of its simulations. They run as in run_persistent, or
+    with session as one SESSION, see run_session. With force every simulation runs again, with
+    verify the checksums of the outputs are compared, see job_done. With region the outputs only
+    hold its elements, it cannot be used with session."""
+    subject, coils = item
+    pathfem = subject_pathfem(subject, out_dir)
+    jobs = missing_jobs(coils, pathfem, subject_id(subject), fields, force, region, verify)
+    if not jobs:
+        return pathfem
+    if session:
+        run_session(jobs, subject, pathfem, fields, cpus)
+    else:
+        run_persistent(jobs, subject, fields, region)
+
+    return pathfem
+
+
+def run_table(
+    fn: str,
+    out_dir: str = "tms_simu",
+    processes: int = None,
+    fields: str = "eE",
+    cpus: int = 1,
+    session: bool = False,
+    force: bool = False,
+    region=None,
+    verify: bool = False,
+):
+    """Runs every simulation of a table that is not complete, the subjects in parallel
+
+    Parameters
+    ----------
+    fn : str
+        The csv file, see read_table
+    out_dir : str
+        Directory for the simulations, with a subdirectory per subject
+    processes : int
+        The amount of worker processes of the whole batch, os.cpu_count() if None. With session
+        every subject uses cpus of them, so processes // cpus subjects are simulated at once
+    fields : str
+        Fields to calculate
+    cpus : int
+        The amount of simulations of a subject run at once with session
+    session : bool
+        Run the simulations of a subject as one SESSION, see run_session, instead of factorizing
+        its FEM system once for all of its coils, see run_persistent
+    force : bool
+        Run every simulation even if it is complete
+    region : Region
+        Only the fields in the elements of this region are written, see TMSRegion. It cannot be
+        used with session
+    verify : bool
+        Also compare the checksums of the outputs before skipping them, see job_done
+
+    Returns
+    -------
+        The directories of the simulations of every subject
+    """
+    if region is not None and session:
+        raise ValueError("A region of interest cannot be used with session, a SESSION writes the fields of the whole head")
+    groups = group_rows(read_table(fn))
+    run = partial(
+        run_subject, out_dir=out_dir, fields=fields, cpus=cpus, session=session, force=force, region=region,
+        verify=verify,
+    )
+    processes = os.cpu_count() if processes is None else processes
+    subjects = max(1, min(len(groups), processes // cpus if session else processes))
+    if subjects == 1:
+        return [run(item) for item in groups.items()]
+    with ProcessPoolExecutor(subjects) as pool:
+        return list(pool.map(run, groups.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a table of SimNIBS TMS simulations")
+    parser.add_argument("table", help="csv file with the columns " + ", ".join(COLUMNS))
+    parser.add_argument("--out-dir", default="tms_simu", help="Directory for the simulations")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="Worker processes of the batch, shared by the subjects and their --cpus"
+    )
+    parser.add_argument("--cpus", type=int, default=1, help="Simulations of a subject run at once with --session")
+    parser.add_argument("--fields", default="eE", help="Fields to calculate")
+    parser.add_argument(
+        "--session", action="store_true",
+        help="Run the simulations of a subject as one SESSION instead of factorizing its FEM system once",
+    )
+    parser.add_argument("--force", action="store_true", help="Run the simulations even if they are complete")
+    parser.add_argument(
+        "--verify", action="store_true", help="Compare the checksums of the outputs before skipping them"
+    )
+    add_region_arguments(parser)
+    args = parser.parse_args()
+    region = region_from_arguments(args)
+    if region is not None and args.session:
+        parser.error("a region of interest cannot be used with --session, a SESSION writes the fields of the whole head")
+
+    for pathfem in run_table(
+        args.table, args.out_dir, args.processes, args.fields, args.cpus, args.session, args.force,
+        region, args.verify,
+    ):
+        print(pathfem)
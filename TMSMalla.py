@@ -0,0 +1,132 @@
+""" Binary cache of the head meshes, such as Mouse_Digimouse.msh
+    Parsing a .msh file takes much longer than reading its arrays. The first load of a mesh stores
+    its nodes, elements and tags as .npy files in a directory named after the sha256 of the file;
+    later loads, also from other processes of a batch, map those files instead of parsing the mesh.
+    The arrays are mapped copy-on-write, so nothing is read until it is used and SimNIBS can still
+    modify them in memory.
+
+    Example:
+
+    mesh = load_mesh('Mouse_Digimouse.msh')
+
+    Run with, to convert meshes ahead of a batch:
+
+    simnibs_python TMSMalla.py Mouse_Digimouse.msh m2m_ernie/ernie.msh
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from simnibs import mesh_io
+
+# Bump when the stored arrays change so that old caches are not reused
+MESH_VERSION = 1
+
+# Default location of the cache
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "TFM", "mallas")
+
+# Arrays of the mesh stored in the cache
+ARRAYS = ("node_coord", "elm_type", "tag1", "tag2", "node_number_list")
+
+
+def file_hash(fn: str, block: int = 2**20):
+    """sha256 of a file as a hex string, it reads the file in blocks"""
+    h = hashlib.sha256()
+    with open(fn, "rb") as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _write_atomic(fn: str, text: str):
+    tmp = f"{fn}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, fn)
+
+
+def mesh_key(fn: str, directory: str = None):
+    """Key of the cache of a mesh file, the sha256 of its contents and MESH_VERSION. The hash is
+    remembered for the path, size and modification time of the file, so an unchanged file is not
+    read again."""
+    directory = cache_dir if directory is None else directory
+    stat = os.stat(fn)
+    stat_key = hashlib.sha256(f"{os.path.abspath(fn)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    stat_fn = os.path.join(directory, "stat", stat_key)
+    try:
+        with open(stat_fn) as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    key = f"v{MESH_VERSION}-{file_hash(fn)}"
+    os.makedirs(os.path.dirname(stat_fn), exist_ok=True)
+    _write_atomic(stat_fn, key)
+
+    return key
+
+
+def write_cache(mesh, path: str):
+    """Stores the arrays of a mesh in the directory path, through a temporary directory so that
+    a crash or another process converting the same mesh never leaves it incomplete"""
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(path))
+    np.save(os.path.join(tmp, "node_coord.npy"), np.asarray(mesh.nodes.node_coord, dtype=np.float64))
+    for name in ARRAYS[1:]:
+        np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(getattr(mesh.elm, name)))
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Another process stored it first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_cache(path: str):
+    """Creates a mesh from the arrays stored in the directory path, mapped copy-on-write"""
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c") for name in ARRAYS}
+    nodes = mesh_io.Nodes()
+    nodes.node_coord = arrays["node_coord"]
+    elements = mesh_io.Elements()
+    for name in ARRAYS[1:]:
+        setattr(elements, name, arrays[name])
+
+    return mesh_io.Msh(nodes, elements)
+
+
+def load_mesh(fn: str, directory: str = None):
+    """Reads a mesh through the cache, parsing and storing it on the first load
+
+    Parameters
+    ----------
+    fn : str
+        The .msh file
+    directory : str
+        The directory of the cache, cache_dir if None
+
+    Returns
+    -------
+        The mesh, a Msh
+    """
+    directory = cache_dir if directory is None else directory
+    path = os.path.join(directory, mesh_key(fn, directory))
+    if not os.path.isdir(path):
+        write_cache(mesh_io.read_msh(fn), path)
+    mesh = read_cache(path)
+    mesh.fn = fn
+
+    return mesh
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stores head meshes in the binary cache")
+    parser.add_argument("meshes", nargs="+", help="The .msh files")
+    parser.add_argument("--cache-dir", default=None, help="The directory of the cache")
+    args = parser.parse_args()
+
+    directory = cache_dir if args.cache_dir is None else args.cache_dir
+    for fn in args.meshes:
+        load_mesh(fn, directory)
+        print(os.path.join(directory, mesh_key(fn, directory)))
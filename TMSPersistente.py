@@ -0,0 +1,97 @@
+""" TMS simulations of one head model that reuse the FEM system across coils and positions
+    run_simnibs assembles the stiffness matrix of the head and factorizes it (or builds its
+    preconditioner) once per TMS list, although it only depends on the mesh and the conductivities.
+    PersistentSolver does it once per head model and keeps it in memory: every later coil position
+    only assembles the right-hand side of its dA/dt and solves with the factorized system.
+    The head mesh is read through the binary cache of TMSMalla.
+
+    Example:
+
+    solver = PersistentSolver(subpath='m2m_ernie')
+    solver.run('legacy_and_other/ModeladoL1052.tcd', [0.0, 15.0, 99.0], [1.0, 0.0, 1.0], 4, 6.283185307,
+               'tms_simu/ModeladoL1052.msh')
+"""
+import os
+
+from simnibs import mesh_io, sim_struct
+from simnibs.simulation import fem
+from simnibs.simulation.tms_coil.tms_coil import TmsCoil
+from simnibs.utils.file_finder import SubjectFiles
+
+from TMSMalla import load_mesh
+
+
+class PersistentSolver:
+    """FEM system of a head model, assembled and factorized once
+
+    Parameters
+    ----------
+    fnamehead : str
+        The head model, such as Mouse_Digimouse.msh, the one of subpath if None
+    subpath : str
+        The m2m-folder of the subject, used if fnamehead is None
+    fields : str
+        Fields to calculate
+    solver_options : str
+        Passed to the FEM system, the default solver of SimNIBS if None
+    """
+
+    def __init__(self, fnamehead: str = None, subpath: str = None, fields: str = "eE", solver_options: str = None):
+        if fnamehead is None:
+            if subpath is None:
+                raise ValueError("Either fnamehead or subpath is needed")
+            fnamehead = SubjectFiles(subpath=subpath).fnamehead
+        self.fnamehead = fnamehead
+        self.fields = fields
+        # Through the binary cache, the mesh is parsed once for every process and run
+        self.mesh = load_mesh(fnamehead)
+        # Default conductivities of SimNIBS, as a TMS list uses them
+        self.cond = sim_struct.TMSLIST().cond2elmdata(self.mesh)
+        self.system = fem.TMSFEM(self.mesh, self.cond, solver_options)
+        self.coils = {}
+
+    def coil(self, fnamecoil: str):
+        """The coil of a file, read once"""
+        if fnamecoil not in self.coils:
+            self.coils[fnamecoil] = TmsCoil.from_file(fnamecoil)
+        return self.coils[fnamecoil]
+
+    def matsimnibs(self, centre, pos_ydir, distance: float):
+        """Position of the coil from its centre, orientation and distance to the head (mm)"""
+        return self.mesh.calc_matsimnibs(centre, pos_ydir, distance)
+
+    def solve(self, fnamecoil: str, matsimnibs, didt: float):
+        """Solves a coil position with the factorized system
+
+        Parameters
+        ----------
+        fnamecoil : str
+            The coil model
+        matsimnibs : np.ndarray
+            The position of the coil, shape (4, 4), see matsimnibs
+        didt : float
+            The rate of change of the current (A/s)
+
+        Returns
+        -------
+            The head mesh with the fields
+        """
+        dadt = self.coil(fnamecoil).get_da_dt(self.mesh, matsimnibs, didt)
+        dadt.field_name = "D"
+        dadt.mesh = self.mesh
+        # Only the right-hand side changes with the position, the solve reuses the factorization
+        v = self.system.solve(self.system.assemble_rhs(dadt))
+        v = mesh_io.NodeData(v, name="v", mesh=self.mesh)
+
+        return fem.calc_fields(v, self.fields, cond=self.cond, dadt=dadt)
+
+    def run(self, fnamecoil: str, centre, pos_ydir, distance: float, didt: float, fn_out: str, region=None):
+        """Solves a coil position, see solve, and writes the fields to fn_out, only in the elements
+        of region if it is a Region of TMSRegion"""
+        os.makedirs(os.path.dirname(fn_out) or ".", exist_ok=True)
+        mesh = self.solve(fnamecoil, self.matsimnibs(centre, pos_ydir, distance), didt)
+        if region is not None:
+            mesh = region.crop(mesh)
+        mesh.write(fn_out)
+
+        return fn_out
@@ -0,0 +1,430 @@
+""" Fast search of the coil position for a cortical target, by reciprocity
+    The E-field at the target along a direction is a linear function of the dA/dt of the coil
+    in the head. One FEM solve with a current dipole at the target, as the adjoint of that function,
+    gives its weights q in every element of the head, so the E-field of any coil position is
+    sum(q * dA/dt). Swapping the sums, it is the vector potential of the currents q seen by the
+    segments of the coil: that potential is computed once with the treecode of Campo at the nodes
+    of a grid next to the segments of the positions, and every coil position costs an interpolation
+    at its segments instead of a FEM solve. The scale and the sign of the right-hand side and of the
+    E-field of SimNIBS are read from its own assemble_rhs and calc_fields, see fem_convention.
+
+    Run with:
+
+    simnibs_python TMSReciproco.py --subpath m2m_ernie --coil legacy_and_other/ModeladoL1052.tcd
+        --target -39 -6 66 --distance 4 --out positions.csv
+
+    The positions are written ranked, as a table for TMSLote to simulate the best of them.
+"""
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+from simnibs import mesh_io
+from simnibs.simulation import fem
+
+from TMSPersistente import PersistentSolver
+from TMSRegion import GM_TAG
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Bobinas"))
+from Campo import point_vector_potential  # noqa: E402
+
+# Tag of the skin surface in the head models of SimNIBS
+SKIN_TAG = 1005
+
+
+def _tetra_gradients(nodes, tetrahedra):
+    """Gradients (1/mm) of the linear shape functions of the tetrahedra, shape (M, 4, 3)"""
+    x = nodes[tetrahedra]
+    edges = x[:, 1:] - x[:, :1]
+    # The barycentric coordinates 1..3 are inv(edges).T @ (x - x0)
+    gradients = np.empty((len(tetrahedra), 4, 3))
+    gradients[:, 1:] = np.linalg.inv(edges).transpose(0, 2, 1)
+    gradients[:, 0] = -gradients[:, 1:].sum(axis=1)
+
+    return gradients
+
+
+def conductivity_tensors(cond, elements):
+    """Conductivities (S/m) of the elements as tensors, shape (n, 3, 3), from the isotropic values
+    of SimNIBS, shape (N,), or the anisotropic ones, shape (N, 9)"""
+    sigma = np.asarray(cond.value, dtype=float)[elements]
+    if sigma.ndim == 1 or sigma.shape[1] == 1:
+        return sigma.reshape(-1, 1, 1) * np.eye(3)
+    if sigma.shape[1] == 9:
+        return sigma.reshape(-1, 3, 3)
+    raise ValueError(f"Unsupported conductivities of shape {sigma.shape}, expected (N,) or (N, 9)")
+
+
+def fem_convention(solver: PersistentSolver, tetrahedra, gradients, volumes, sigma, seed: int = 0):
+    """Scale and sign of the TMS problem of SimNIBS against the operators of this module.
+    The right-hand side of assemble_rhs(dadt) is alpha * G^T (vol sigma dadt), with G the gradients
+    (1/m) of the shape functions and vol the volumes (m^3), and calc_fields gives
+    E = beta * G v + gamma * dadt. alpha is fitted on a random dA/dt, beta and gamma on the
+    potential v = x (mm) and a uniform dA/dt along y.
+
+    Parameters
+    ----------
+    solver : PersistentSolver
+        The FEM system of the head model
+    tetrahedra : np.ndarray
+        Whether every element of the mesh is a tetrahedron, shape (N,)
+    gradients : np.ndarray
+        The gradients (1/m) of the shape functions of the tetrahedra, shape (M, 4, 3)
+    volumes : np.ndarray
+        The volumes (mm^3) of the tetrahedra, shape (M,)
+    sigma : np.ndarray
+        The conductivities (S/m) of the tetrahedra, shape (M, 3, 3)
+    seed : int
+        The seed of the random dA/dt
+
+    Returns
+    -------
+        alpha, beta and gamma. Raises a ValueError if SimNIBS does not follow these forms, the
+        reciprocal weights would be wrong
+    """
+    mesh = solver.mesh
+    elements = mesh.elm.node_number_list[tetrahedra] - 1
+    dadt = np.zeros((len(tetrahedra), 3))
+    dadt[tetrahedra] = np.random.default_rng(seed).standard_normal((len(elements), 3))
+    b = solver.system.assemble_rhs(mesh_io.ElementData(dadt, name="D", mesh=mesh))
+    flux = (volumes * 1e-9)[:, None] * np.einsum("eij,ej->ei", sigma, dadt[tetrahedra])
+    own = np.zeros(len(b))
+    np.add.at(own, elements, np.einsum("eki,ei->ek", gradients, flux))
+    # The nodes of the Dirichlet condition may differ, the median ratio ignores them
+    large = np.abs(own) > 1e-3 * np.abs(own).max()
+    alpha = np.median(b[large] / own[large])
+    mismatch = np.abs(b - alpha * own) > 1e-6 * np.abs(b).max()
+    if mismatch.sum() > max(1, 1e-4 * len(b)):
+        raise ValueError(f"assemble_rhs of SimNIBS differs from alpha * G^T (vol sigma dadt) at {mismatch.sum()} nodes")
+
+    v = mesh_io.NodeData(mesh.nodes.node_coord[:, 0].copy(), name="v", mesh=mesh)
+    uniform = np.zeros((len(tetrahedra), 3))
+    uniform[:, 1] = 1
+    e = fem.calc_fields(v, "E", cond=solver.cond, dadt=mesh_io.ElementData(uniform, name="D", mesh=mesh))
+    e = e.field["E"].value[tetrahedra]
+    # G v = 1e3 along x for v = x in mm and G in 1/m
+    beta, gamma = np.mean(e[:, 0]) / 1e3, np.mean(e[:, 1])
+    if np.abs(e - (1e3 * beta, gamma, 0)).max() > 1e-6 * np.abs(e).max():
+        raise ValueError("calc_fields of SimNIBS is not beta * grad(v) + gamma * dadt")
+
+    return alpha, beta, gamma
+
+
+def coil_segments(coil):
+    """Midpoints and vectors (mm) of the line segments of every element of a coil, shape (n, 3) each"""
+    midpoints, vectors = [], []
+    for element in coil.elements:
+        midpoints.append(element.points + element.values / 2)
+        vectors.append(element.values)
+
+    return np.concatenate(midpoints), np.concatenate(vectors)
+
+
+def candidate_poses(
+    mesh,
+    target,
+    distance: float,
+    search_radius: float = 20.0,
+    spatial_resolution: float = 5.0,
+    angle_resolution: float = 30.0,
+    pos_ydir=(0.0, 1.0, 0.0),
+    skin_tag: int = SKIN_TAG,
+):
+    """Coil positions on the skin around a target, as the search of SimNIBS spans them
+
+    Parameters
+    ----------
+    mesh : Msh
+        The head mesh
+    target : list
+        The target (mm)
+    distance : float
+        Distance from coil surface to head surface (mm)
+    search_radius : float
+        The positions are on the skin within this distance (mm) of the point closest to the target
+    spatial_resolution : float
+        The spacing (mm) of the positions on the skin
+    angle_resolution : float
+        The step (degrees) of the orientations at every position
+    pos_ydir : list
+        The orientation of angle 0, projected onto the skin
+    skin_tag : int
+        The tag of the skin surface
+
+    Returns
+    -------
+    centres : np.ndarray
+        The points on the skin, as pos.centre, shape (P, 3)
+    matsimnibs : np.ndarray
+        The position of the coil, shape (P, 4, 4)
+    """
+    skin = mesh.crop_mesh(tags=[skin_tag])
+    nodes = skin.nodes.node_coord
+    normals = skin.nodes_normals().value
+    # Outwards, away from the centre of the head
+    normals *= np.sign(np.sum(normals * (nodes - nodes.mean(axis=0)), axis=1))[:, None]
+
+    closest = nodes[np.argmin(np.linalg.norm(nodes - np.asarray(target), axis=1))]
+    near = np.flatnonzero(np.linalg.norm(nodes - closest, axis=1) <= search_radius)
+    # One node per cell of the spatial resolution
+    _, first = np.unique(np.floor(nodes[near] / spatial_resolution), axis=0, return_index=True)
+    near = near[np.sort(first)]
+
+    angles = np.deg2rad(np.arange(0.0, 360.0, angle_resolution))
+    centres = np.repeat(nodes[near], len(angles), axis=0)
+    z = -np.repeat(normals[near], len(angles), axis=0)
+    angle = np.tile(angles, len(near))
+    y0 = np.asarray(pos_ydir, dtype=float) - np.sum(np.asarray(pos_ydir) * z, axis=1)[:, None] * z
+    y0 /= np.linalg.norm(y0, axis=1)[:, None]
+    x0 = np.cross(y0, z)
+    y = np.cos(angle)[:, None] * y0 - np.sin(angle)[:, None] * x0
+    x = np.cross(y, z)
+
+    matsimnibs = np.zeros((len(centres), 4, 4))
+    matsimnibs[:, :3, 0], matsimnibs[:, :3, 1], matsimnibs[:, :3, 2] = x, y, z
+    matsimnibs[:, :3, 3] = centres - distance * z
+    matsimnibs[:, 3, 3] = 1
+
+    return centres, matsimnibs
+
+
+class ReciprocalTarget:
+    """Weights of the E-field at a target in every element of a head, from a reciprocal solve.
+    The E-field at the target is T = sum_roi w n . E with E = beta * G v + gamma * dadt and
+    K v = alpha * G^T (vol sigma dadt), see fem_convention. With u = K^-1 G_roi^T (w n) and K
+    symmetric, T = sum alpha * beta * vol (sigma G u) . dadt + sum_roi gamma * w n . dadt
+
+    Parameters
+    ----------
+    solver : PersistentSolver
+        The FEM system of the head model
+    target : list
+        The centre of the target (mm)
+    direction : list
+        The direction of the E-field at the target, its norm is used if None
+    radius : float
+        The target is the mean over the elements of the tissues within this radius (mm)
+    tags : tuple
+        The tissues of the target
+    """
+
+    def __init__(self, solver: PersistentSolver, target, direction=None, radius: float = 2.0, tags=(GM_TAG,)):
+        mesh = solver.mesh
+        self.solver = solver
+        self.target = np.asarray(target, dtype=float)
+        tetrahedra = mesh.elm.elm_type == 4
+        nodes = mesh.nodes.node_coord
+        elements = mesh.elm.node_number_list[tetrahedra] - 1
+        centres = mesh.elements_baricenters().value[tetrahedra]
+        volumes = mesh.elements_volumes_and_areas().value[tetrahedra]
+        sigma = conductivity_tensors(solver.cond, tetrahedra)
+
+        in_tissue = np.isin(mesh.elm.tag1[tetrahedra], tags)
+        distance = np.linalg.norm(centres - self.target, axis=1)
+        roi = in_tissue & (distance <= radius)
+        if not roi.any():
+            roi = np.arange(len(centres)) == np.argmin(np.where(in_tissue, distance, np.inf))
+        self.roi = np.flatnonzero(tetrahedra)[roi]
+        weights = volumes[roi] / volumes[roi].sum()
+
+        gradients = _tetra_gradients(nodes, elements) * 1e3
+        alpha, beta, gamma = fem_convention(solver, tetrahedra, gradients, volumes, sigma)
+        self.directions = np.eye(3) if direction is None else np.asarray(direction, dtype=float)[None] / np.linalg.norm(direction)
+        # The currents q of every element and the dipoles of dA/dt at the target
+        self.sources = np.concatenate((centres, centres[roi]))
+        self.currents = np.empty((len(self.directions), len(self.sources), 3))
+        for k, n in enumerate(self.directions):
+            b = np.zeros(len(nodes))
+            np.add.at(b, elements[roi], weights[:, None] * (gradients[roi] @ n))
+            u = solver.system.solve(b)
+            grad_u = np.einsum("eij,ei->ej", gradients, u[elements])
+            self.currents[k, : len(centres)] = alpha * beta * (volumes * 1e-9)[:, None] * np.einsum(
+                "eij,ej->ei", sigma, grad_u
+            )
+            self.currents[k, len(centres):] = gamma * weights[:, None] * n
+
+    def potential(self, points, theta: float = 0.2):
+        """Vector potential of the weights (V/m per A/s) at the points (mm), shape (k, m, 3), by the
+        treecode of Campo with the opening ratio theta"""
+        points = np.asarray(points, dtype=float)
+        return np.stack([point_vector_potential(self.sources, currents, points, theta=theta) for currents in self.currents])
+
+    def evaluate(
+        self, fnamecoil: str, matsimnibs, didt: float = 1.0, resolution: float = 1.0, block: int = 256, theta: float = 0.2
+    ):
+        """E-field at the target for many positions of a coil
+
+        Parameters
+        ----------
+        fnamecoil : str
+            The coil model
+        matsimnibs : np.ndarray
+            The positions of the coil, shape (P, 4, 4)
+        didt : float
+            The rate of change of the current (A/s)
+        resolution : float
+            The spacing (mm) of the grid of the potential, interpolated at the segments of the coil.
+            The interpolation error is about 1% at 1 mm for a coil 4 mm above the skin
+        block : int
+            The amount of positions interpolated at once
+        theta : float
+            The opening ratio of the treecode of the potential, see potential
+
+        Returns
+        -------
+            The E-field (V/m) along the direction, or its norm, for every position, shape (P,)
+        """
+        midpoints, vectors = coil_segments(self.solver.coil(fnamecoil))
+        matsimnibs = np.asarray(matsimnibs, dtype=float)
+        rotation, translation = matsimnibs[:, :3, :3], matsimnibs[:, :3, 3]
+
+        # Grid around every segment of every position
+        corners = np.stack(np.meshgrid(*zip(midpoints.min(axis=0), midpoints.max(axis=0)), indexing="ij"), -1)
+        corners = np.einsum("pij,cj->pci", rotation, corners.reshape(-1, 3)) + translation[:, None]
+        lower = np.floor(corners.min(axis=(0, 1)) / resolution - 1) * resolution
+        upper = np.ceil(corners.max(axis=(0, 1)) / resolution + 1) * resolution
+        shape = tuple(np.round((upper - lower) / resolution).astype(int) + 1)
+
+        def coordinates(i):
+            """Segments of the positions of block i and their coordinates in the grid"""
+            r = rotation[i:i + block]
+            points = np.einsum("pij,sj->psi", r, midpoints) + translation[i:i + block, None]
+            return np.einsum("pij,sj->psi", r, vectors), (points - lower) / resolution
+
+        # The potential is only needed at the corners of the cells that hold a segment, a thin
+        # shell around the windings instead of the whole box
+        cells = np.unique(
+            np.concatenate([
+                np.ravel_multi_index(np.floor(coordinates(i)[1]).astype(int).reshape(-1, 3).T, shape, mode="clip")
+                for i in range(0, len(matsimnibs), block)
+            ])
+        )
+        offsets = np.stack(np.meshgrid((0, 1), (0, 1), (0, 1), indexing="ij"), -1).reshape(-1, 3)
+        nodes = np.array(np.unravel_index(cells, shape)).T
+        nodes = np.unique(
+            np.ravel_multi_index((nodes[:, None] + offsets).reshape(-1, 3).T, shape, mode="clip")
+        )
+        grid = lower + resolution * np.array(np.unravel_index(nodes, shape)).T
+        potential = np.zeros((len(self.directions), np.prod(shape), 3))
+        potential[:, nodes] = self.potential(grid, theta)
+        potential = potential.reshape((len(self.directions),) + shape + (3,))
+
+        values = np.empty((len(matsimnibs), len(self.directions)))
+        for i in range(0, len(matsimnibs), block):
+            segments, points = coordinates(i)
+            coords = np.moveaxis(points, -1, 0).reshape(3, -1)
+            for k in range(len(self.directions)):
+                a = np.stack(
+                    [map_coordinates(potential[k, ..., j], coords, order=1, mode="nearest") for j in range(3)],
+                    axis=-1,
+                ).reshape(points.shape)
+                values[i:i + block, k] = didt * np.sum(a * segments, axis=(1, 2))
+
+        return values[:, 0] if len(self.directions) == 1 else np.linalg.norm(values, axis=1)
+
+    def exact(self, fnamecoil: str, matsimnibs, didt: float = 1.0):
+        """E-field at the target for a position of the coil from a full FEM solve, to compare with evaluate"""
+        mesh = self.solver.solve(fnamecoil, matsimnibs, didt)
+        e = mesh.field["E"].value[self.roi]
+        volumes = mesh.elements_volumes_and_areas().value[self.roi]
+        e = np.sum(volumes[:, None] * e, axis=0) / volumes.sum()
+        values = self.directions @ e
+
+        return values[0] if len(self.directions) == 1 else np.linalg.norm(values)
+
+
+def search(
+    solver: PersistentSolver,
+    fnamecoil: str,
+    target,
+    distance: float,
+    direction=None,
+    didt: float = 1.0,
+    resolution: float = 1.0,
+    **options,
+):
+    """Ranks the positions of a coil by the E-field at a target
+
+    Parameters
+    ----------
+    solver : PersistentSolver
+        The FEM system of the head model
+    fnamecoil : str
+        The coil model
+    target : list
+        The target (mm)
+    distance : float
+        Distance from coil surface to head surface (mm)
+    direction : list
+        The direction of the E-field at the target, its norm is used if None
+    didt : float
+        The rate of change of the current (A/s)
+    resolution : float
+        See ReciprocalTarget.evaluate
+    options :
+        Passed to candidate_poses
+
+    Returns
+    -------
+    centres : np.ndarray
+        The points on the skin of the positions, best first, shape (P, 3)
+    matsimnibs : np.ndarray
+        The positions of the coil, shape (P, 4, 4)
+    values : np.ndarray
+        The E-field (V/m) at the target, shape (P,)
+    """
+    centres, matsimnibs = candidate_poses(solver.mesh, target, distance, **options)
+    reciprocal = ReciprocalTarget(solver, target, direction)
+    values = reciprocal.evaluate(fnamecoil, matsimnibs, didt, resolution)
+    order = np.argsort(-values)
+
+    return centres[order], matsimnibs[order], values[order]
+
+
+def write_positions(fn: str, subject: str, fnamecoil: str, centres, matsimnibs, distance: float, didt: float, values):
+    """Writes ranked positions as a table of TMSLote, with the E-field at the target as an extra column"""
+    with open(fn, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("subject", "coil", "centre", "pos_ydir", "distance", "didt", "E"))
+        for centre, m, value in zip(centres, matsimnibs, values):
+            pos_ydir = centre + m[:3, 1]
+            writer.writerow(
+                (subject, fnamecoil, " ".join(map(str, centre)), " ".join(map(str, pos_ydir)), distance, didt, value)
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks the positions of a coil for a target by reciprocity")
+    head = parser.add_mutually_exclusive_group(required=True)
+    head.add_argument("--subpath", help="m2m-folder of the subject")
+    head.add_argument("--fnamehead", help="Head model, such as Mouse_Digimouse.msh")
+    parser.add_argument("--coil", required=True, help="The coil model")
+    parser.add_argument("--target", type=float, nargs=3, required=True, help="The target (mm)")
+    parser.add_argument("--direction", type=float, nargs=3, default=None, help="Direction of the E-field, its norm if omitted")
+    parser.add_argument("--distance", type=float, default=4.0, help="Distance from coil surface to head surface (mm)")
+    parser.add_argument("--didt", type=float, default=6.283185307, help="Rate of change of the current (A/s)")
+    parser.add_argument("--search-radius", type=float, default=20.0, help="Radius of the search on the skin (mm)")
+    parser.add_argument("--spatial-resolution", type=float, default=5.0, help="Spacing of the positions (mm)")
+    parser.add_argument("--angle-resolution", type=float, default=30.0, help="Step of the orientations (degrees)")
+    parser.add_argument("--out", default="positions.csv", help="The ranked positions, a table of TMSLote")
+    args = parser.parse_args()
+
+    solver = PersistentSolver(fnamehead=args.fnamehead, subpath=args.subpath)
+    centres, matsimnibs, values = search(
+        solver,
+        args.coil,
+        args.target,
+        args.distance,
+        args.direction,
+        args.didt,
+        search_radius=args.search_radius,
+        spatial_resolution=args.spatial_resolution,
+        angle_resolution=args.angle_resolution,
+    )
+    write_positions(
+        args.out, args.subpath or args.fnamehead, args.coil, centres, matsimnibs, args.distance, args.didt, values
+    )
+    print(f"Best of {len(values)} positions: centre {centres[0]}, E = {values[0]:.4g} V/m")
@@ -0,0 +1,90 @@
+""" Region of interest of the outputs of TMS simulations
+    Most studies only need the E-field in a region, such as the grey matter next to the target,
+    while SimNIBS writes the fields of the whole head. A Region selects the elements of a sphere,
+    of some tissues and of a list of elements, e.g. the elements of a cortical label of an atlas,
+    and crops the outputs to them, so they are smaller and faster to write and to read.
+"""
+import hashlib
+
+import numpy as np
+
+# Tag of the grey matter in the head models of SimNIBS
+GM_TAG = 2
+
+
+class Region:
+    """Elements of a mesh in a sphere, in some tissues and in a list, all that are given
+
+    Parameters
+    ----------
+    centre : list
+        The centre of the sphere (mm)
+    radius : float
+        The radius of the sphere (mm), the elements with the centre inside it are selected
+    tags : list
+        The tissues, as tag1 of the elements
+    elements : np.ndarray
+        The numbers of the elements, 1-based as in SimNIBS
+    """
+
+    def __init__(self, centre=None, radius: float = None, tags=None, elements=None):
+        if (centre is None) != (radius is None):
+            raise ValueError("A sphere needs both a centre and a radius")
+        self.centre = None if centre is None else np.asarray(centre, dtype=float)
+        self.radius = radius
+        self.tags = None if tags is None else [int(tag) for tag in tags]
+        self.elements = None if elements is None else np.unique(np.asarray(elements, dtype=int))
+
+    @classmethod
+    def from_file(cls, fn: str, **options):
+        """Region of the elements stored in a .npy or text file, with the options of Region"""
+        elements = np.load(fn) if fn.endswith(".npy") else np.loadtxt(fn, dtype=int)
+        return cls(elements=elements, **options)
+
+    def as_dict(self):
+        """The parameters of the region, as json, the elements as their sha256"""
+        return dict(
+            centre=None if self.centre is None else self.centre.tolist(),
+            radius=self.radius,
+            tags=self.tags,
+            elements=None if self.elements is None else hashlib.sha256(self.elements.tobytes()).hexdigest(),
+        )
+
+    def mask(self, mesh):
+        """Whether every element of the mesh is in the region"""
+        mask = np.ones(len(mesh.elm.tag1), dtype=bool)
+        if self.tags is not None:
+            mask &= np.isin(mesh.elm.tag1, self.tags)
+        if self.centre is not None:
+            mask &= np.linalg.norm(mesh.elements_baricenters().value - self.centre, axis=1) <= self.radius
+        if self.elements is not None:
+            mask &= np.isin(np.arange(1, len(mask) + 1), self.elements)
+
+        return mask
+
+    def crop(self, mesh):
+        """The mesh with only the elements of the region and their fields"""
+        elements = np.flatnonzero(self.mask(mesh)) + 1
+        if len(elements) == 0:
+            raise ValueError("The region has no elements of the mesh")
+        return mesh.crop_mesh(elements=elements)
+
+
+def add_region_arguments(parser):
+    """Adds the arguments of a Region to an argparse parser"""
+    parser.add_argument("--roi-centre", type=float, nargs=3, default=None, help="Centre of a spherical region (mm)")
+    parser.add_argument("--roi-radius", type=float, default=None, help="Radius of the spherical region (mm)")
+    parser.add_argument(
+        "--roi-tags", type=int, nargs="+", default=None, help=f"Tissues of the region, e.g. {GM_TAG} for grey matter"
+    )
+    parser.add_argument("--roi-elements", default=None, help="A .npy or text file with the elements of the region")
+
+
+def region_from_arguments(args):
+    """The Region of the arguments of add_region_arguments, None if none was given"""
+    options = dict(centre=args.roi_centre, radius=args.roi_radius, tags=args.roi_tags)
+    if args.roi_elements is not None:
+        return Region.from_file(args.roi_elements, **options)
+    if all(value is None for value in options.values()):
+        return None
+    return Region(**options)